@@ -0,0 +1,157 @@
+from enum import Enum
+from typing import Optional
+
+from fastapi import HTTPException, Request
+
+from app.db_wrapper import DbWrapper
+from app.models.main import Identity, address_key
+from app.profiling import span
+
+
+class Access(str, Enum):
+    PUBLIC = "public"  # Admin + Registered User + Unregistered User
+    REGISTERED = "registered"  # Admin + Registered User
+    ADMIN = "admin"  # Admin only
+
+
+# Access policy of every route. Routes missing from the table are Admin only.
+POLICIES = {
+    "/": Access.PUBLIC,
+    "/user_exists": Access.ADMIN,
+    "/get_users": Access.ADMIN,
+    "/set_user": Access.ADMIN,
+    "/update_user": Access.REGISTERED,
+    "/get_user": Access.REGISTERED,
+    "/user/signature": Access.PUBLIC,
+    "/user/verify": Access.PUBLIC,
+    "/user/logout": Access.REGISTERED,
+    "/admin/signature": Access.PUBLIC,
+    "/admin/verify": Access.PUBLIC,
+    "/admin/slow_requests": Access.ADMIN,
+    "/get_emails": Access.ADMIN,
+    "/set_email": Access.REGISTERED,
+}
+
+
+async def get_token(request: Request) -> Optional[str]:
+    """
+    :param request: incoming request
+    :return: the token from the Authorization: Bearer header or the "token" form
+    field, None if there is neither
+    """
+    authorization = request.headers.get("Authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[len("bearer ") :].strip() or None
+
+    # Starlette caches the parsed form on the request, the endpoint reuses it
+    form = await request.form()
+    return form.get("token") or None
+
+
+class Authorizer:
+    """
+    App-wide dependency enforcing POLICIES. The token is verified at most once per
+    request (one JWT decode, one signature recovery) and the result is stored on
+    request.state.identity for the endpoint to use.
+    """
+
+    def __init__(
+        self, db: DbWrapper, policies: dict = None, default: Access = Access.ADMIN
+    ):
+        """
+        :param db: DbWrapper instance used to verify tokens
+        :param policies: mapping of route path to Access, POLICIES by default
+        :param default: access required by routes missing from policies
+        """
+        self.db = db
+        self.policies = POLICIES if policies is None else policies
+        self.default = default
+
+    def verify(self, request: Request, token: str):
+        """
+        :param request: incoming request
+        :param token: token sent with the request
+        :return: the decoded token if it is valid, False otherwise. Each token is
+        verified once per request, the profiling middleware and identify share it
+        """
+        if not hasattr(request.state, "verified_tokens"):
+            request.state.verified_tokens = {}
+
+        verified = request.state.verified_tokens
+        if token not in verified:
+            verified[token] = self.db.verify(token)
+        return verified[token]
+
+    def is_admin_token(self, request: Request, token: str) -> bool:
+        """
+        :param request: incoming request
+        :param token: token sent with the request
+        :return: True if the token is valid and belongs to an Admin
+        """
+        decoded = self.verify(request, token)
+        return bool(decoded) and self.db.is_admin(decoded["publicAddress"])
+
+    async def identify(self, request: Request) -> Optional[Identity]:
+        """
+        :param request: incoming request
+        :return: the verified identity of the caller, None if anonymous or the
+        token is not valid
+        """
+        if hasattr(request.state, "identity"):
+            return request.state.identity
+
+        identity = None
+        token = await get_token(request)
+        if token:
+            with span("auth"):
+                decoded = self.verify(request, token)
+            if decoded:
+                identity = Identity(
+                    publicAddress=decoded["publicAddress"],
+                    nonce=decoded["nonce"],
+                    admin=self.db.is_admin(decoded["publicAddress"]),
+                    token=token,
+                    exp=decoded["exp"],
+                )
+
+        request.state.identity = identity
+        return identity
+
+    async def __call__(self, request: Request) -> Optional[Identity]:
+        access = self.policies.get(request.url.path, self.default)
+        if access == Access.PUBLIC:
+            request.state.identity = None
+            return None
+
+        identity = await self.identify(request)
+        if identity is None:
+            raise HTTPException(status_code=401, detail="A valid token is required.")
+
+        if access == Access.ADMIN and not identity.admin:
+            raise HTTPException(status_code=403, detail="Admin access required.")
+
+        return identity
+
+
+def require_owner(request: Request, public_address: str) -> None:
+    """
+    Lets Admins through, and Registered Users only for their own public address.
+
+    :param request: incoming request, already passed through Authorizer
+    :param public_address: public address the request acts on
+    """
+    identity = getattr(request.state, "identity", None)
+    if identity is not None and identity.admin:
+        return
+
+    try:
+        is_owner = identity is not None and address_key(
+            identity.publicAddress
+        ) == address_key(public_address)
+    except ValueError:
+        is_owner = False
+
+    if not is_owner:
+        raise HTTPException(
+            status_code=403, detail="You can only access your own profile."
+        )
@@ -1,16 +1,67 @@
 import os
 import jwt
 import logging
+from collections import Counter
 from datetime import datetime
+from typing import Optional
 
+import bson
 from web3 import Web3
-from pymongo import MongoClient
 from dotenv import load_dotenv, find_dotenv
 from eth_account.messages import encode_defunct
 
+from app.decorators.main import traced
+from app.models.main import address_key, normalize_address
+from app.profiling import span
+from app.revocation import RevocationIndex, token_id
+from app.storage.base import Storage, create_storage
+from app.storage.sharded import create_sharded_storage
+
+
+def signature_message(public_address: str, nonce: int, admin: bool = False) -> str:
+    """
+    :param public_address: public address of user
+    :param nonce: current nonce of user
+    :param admin: whether to build the Admin dashboard message
+    :return: the message the wallet has to sign
+    """
+    role = "Admin" if admin else "user"
+    # The surrounding newlines and indentation are part of the signed message
+    return f"""
+                    Authenticating {role} {public_address} with nonce {nonce}
+                    """
+
+
+def sign(account, nonce: int, admin: bool = False) -> str:
+    """
+    Signs like a wallet would, for tests and benchmarks.
+
+    :param account: eth_account LocalAccount of the user
+    :param nonce: current nonce of user
+    :param admin: whether to sign the Admin dashboard message
+    :return: the signature /user/signature or /admin/signature expects
+    """
+    message = encode_defunct(text=signature_message(account.address, nonce, admin))
+    return account.sign_message(message).signature.hex()
+
+
+def user_revision(user_id, version: int) -> str:
+    """
+    :param user_id: _id of user
+    :param version: version of user
+    :return: "<_id>-<version>", changes on every write and never repeats for a
+    deleted and recreated user
+    """
+    return f"{user_id}-{version}"
+
 
 class DbWrapper:
-    def __init__(self, db_name: str):
+    def __init__(self, db_name: str, storage: Storage = None):
+        """
+        :param db_name: name of database to use
+        :param storage: storage backend, built from STORAGE_SHARDS or STORAGE_URL
+        (falling back to MONGODB_PWD) when not given
+        """
         try:
             logging_file_name = str(datetime.timestamp(datetime.now())).split(".")[0]
             logging.basicConfig(
@@ -24,23 +75,43 @@ class DbWrapper:
             load_dotenv(find_dotenv())
             self.logger.info(".env file was loaded.")
 
-            self.client = MongoClient(os.environ.get("MONGODB_PWD"))
-            if self.client:
-                self.logger.info("Connected to MongoDB Successfully.")
-                self.db_name = db_name  # If connected to MongoDB, set db_name
-            else:
-                self.logger.error("Failed to connect to MongoDB.")
+            self.db_name = db_name
+            if storage is None and os.environ.get("STORAGE_SHARDS"):
+                storage = create_sharded_storage(
+                    os.environ.get("STORAGE_SHARDS"), db_name
+                )
+            self.storage = storage or create_storage(
+                os.environ.get("STORAGE_URL") or os.environ.get("MONGODB_PWD"),
+                db_name,
+            )
+            self.logger.info(f"Using storage: {type(self.storage).__name__}")
 
             self.web3 = Web3()
-            self.admins = list(os.environ.get("ADMINS").split(","))
+            self.admins = [
+                admin.strip().lower() for admin in os.environ.get("ADMINS").split(",")
+            ]
             self.logger.info(f"Initialized Admins: {self.admins}")
 
+            self.ensure_indexes()
+
+            self.revocations = RevocationIndex(
+                capacity=int(os.environ.get("REVOKED_TOKENS_CAPACITY", 100_000)),
+                refresh_interval=float(
+                    os.environ.get("REVOKED_TOKENS_REFRESH_SECONDS", 3600)
+                ),
+            )
+            self.rebuild_revocations()
+
+            # Profile update volume, see update_user and benchmarks/bench_update_delta
+            self.write_stats = Counter()
+
             self.logger.info("DbWrapper Initialized Successfully.")
 
         except Exception as e:
             self.logger.error(f"Failed to initialize DbWrapper: {e}")
             raise e
 
+    @traced
     def get_database_names(self) -> list:
         """
         :return: a list of all database names.
@@ -48,63 +119,76 @@ class DbWrapper:
 
         try:
             self.logger.info("Getting database names:")
-            return self.client.list_database_names()
+            return self.storage.database_names()
 
         except Exception as e:
             self.logger.error(f"Failed to get database names: {e}")
             return None
 
-    def get_database(self, db_name: str) -> MongoClient:
+    @traced
+    def get_collection_names(self) -> list:
         """
-        :param db_name: name of database to get
-        :return: database object
+        :return: a list of all collection names
         """
         try:
-            self.logger.info(f"Getting database: {db_name}")
-            return self.client[db_name]
+            self.logger.info(f"Getting collection names from database: {self.db_name}")
+            return self.storage.collection_names()
 
         except Exception as e:
-            self.logger.error(f"Failed to get database: {e}")
+            self.logger.error(f"Failed to get collection names: {e}")
             return None
 
-    def get_collection_names(self) -> list:
+    def ensure_indexes(self) -> bool:
         """
-        :return: a list of all collection names
+        :return: boolean indicating success status
         """
         try:
-            self.logger.info(f"Getting collection names from database: {self.db_name}")
-            return self.get_database(self.db_name).list_collection_names()
+            self.logger.info("Ensuring user indexes")
+            self.storage.ensure_indexes()
+            return True
 
         except Exception as e:
-            self.logger.error(f"Failed to get collection names: {e}")
-            return None
+            self.logger.error(f"Failed to ensure user indexes: {e}")
+            return False
 
-    def get_collection(self, collection_name: str) -> MongoClient:
+    def is_admin(self, user_public_address: str) -> bool:
         """
-        :param collection_name: name of collection to get
-        :return: collection object
+        :param user_public_address: public address of user
+        :return: True if the address is one of the configured admins
+        """
+        return str(user_public_address).lower() in self.admins
+
+    @traced
+    def get_user_revision(self, user_public_address: str) -> Optional[str]:
+        """
+        :param user_public_address: public address of user
+        :return: "<_id>-<version>" of the user, changes on every write and never
+        repeats for a deleted and recreated user; None if the user does not exist
         """
         try:
-            self.logger.info(f"Getting collection: {collection_name}")
-            return self.get_database(self.db_name)[collection_name]
+            # Read from storage every time, other workers and tools write too
+            revision = self.storage.find_user_revision(address_key(user_public_address))
+            return user_revision(*revision) if revision is not None else None
 
         except Exception as e:
-            self.logger.error(f"Failed to get collection: {e}")
+            self.logger.error(f"Failed to get user revision: {e}")
             return None
 
     # User related functions
+    @traced
     def get_users(self) -> list:
         """
         :return: a list of all users
         """
         try:
             self.logger.info("Getting all users")
-            return [i for i in self.get_collection("users").find()]
+            return [i for i in self.storage.find_users()]
 
         except Exception as e:
             self.logger.error(f"Failed to get users: {e}")
             return None
 
+    @traced
     def get_user_by_public_address(self, user_public_address: str) -> dict:
         """
         :param user_public_address: public address of user
@@ -112,14 +196,13 @@ class DbWrapper:
         """
         try:
             self.logger.info(f"Getting user by public address: {user_public_address}")
-            return self.get_collection("users").find_one(
-                {"publicAddress": user_public_address}
-            )
+            return self.storage.find_user(address_key(user_public_address))
 
         except Exception as e:
             self.logger.error(f"Failed to get user by public address: {e}")
             return None
 
+    @traced
     def user_exists(self, user_public_address: str) -> bool:
         """
         :param user_public_address: public address of user
@@ -127,15 +210,13 @@ class DbWrapper:
         """
         try:
             self.logger.info(f"Checking if user exists: {user_public_address}")
-            user = self.get_collection("users").find_one(
-                {"publicAddress": user_public_address}
-            )
-            return user is not None
+            return self.storage.user_exists(address_key(user_public_address))
 
         except Exception as e:
             self.logger.error(f"Failed to check if user exists")
             return False
 
+    @traced
     def set_user(self, user_info: dict) -> str:
         """
         :param user_info: the user info to set
@@ -159,11 +240,15 @@ class DbWrapper:
         try:
             if not self.user_exists(user_info["publicAddress"]):
                 self.logger.info(f"Setting user: {user_info['publicAddress']}")
-                return {
-                    "success": self.get_collection("users")
-                    .insert_one("user_info")
-                    .inserted_id
-                }
+                key = address_key(user_info["publicAddress"])
+                user_id = self.storage.insert_user(
+                    key,
+                    {
+                        **user_info,
+                        "publicAddress": normalize_address(user_info["publicAddress"]),
+                    },
+                )
+                return {"success": user_id}
             else:
                 self.logger.critical("User already exists.")
                 return None
@@ -172,9 +257,14 @@ class DbWrapper:
             self.logger.error(f"Failed to set user: {e}")
             return None
 
-    def update_user(self, user_info: dict) -> bool:
+    @traced
+    def update_user(self, user_info: dict, expected_version: int = None) -> bool:
         """
-        :param user_info: the user info to set
+        Only the fields in user_info that differ from the stored user are written,
+        other fields are left as they are. Nothing is written if nothing changed.
+
+        :param user_info: publicAddress plus the fields to set
+        :param expected_version: only update if the user is still at this version
         :return: boolean indicating success status
         """
         """
@@ -193,20 +283,46 @@ class DbWrapper:
         }
         """
         try:
-            if not self.user_exists(user_info["publicAddress"]):
+            self.write_stats["update_calls"] += 1
+            user = self.get_user_by_public_address(user_info["publicAddress"])
+            if user is None:
                 self.logger.critical("User does not exist.")
                 return False
+            elif (
+                expected_version is not None
+                and user.get("version", 0) != expected_version
+            ):
+                self.logger.critical("User was modified concurrently.")
+                return False
             else:
+                key = address_key(user_info["publicAddress"])
+                changes = {
+                    k: v
+                    for k, v in user_info.items()
+                    # _id and version are maintained by storage, the key never changes
+                    if k not in ("_id", "version", "publicAddress") and user.get(k) != v
+                }
+                if not changes:
+                    self.logger.info(f"User unchanged: {user_info['publicAddress']}")
+                    self.write_stats["skipped_writes"] += 1
+                    return True
+
                 self.logger.info(f"Updating user: {user_info['publicAddress']}")
-                self.get_collection("users").update_one(
-                    {"publicAddress": user_info["publicAddress"]}, {"$set": user_info}
-                )
+                version = self.storage.update_user(key, changes, expected_version)
+                if version is None:
+                    self.logger.critical("User was modified concurrently.")
+                    return False
+
+                self.write_stats["writes"] += 1
+                self.write_stats["fields_written"] += len(changes)
+                self.write_stats["bytes_written"] += len(bson.encode(changes))
                 return True
 
         except Exception as e:
             self.logger.error(f"Failed to update user: {e}")
             return False
 
+    @traced
     def update_user_nonce(self, user_public_address: str, nonce: int) -> bool:
         """
         :param user_public_address: public address of user
@@ -219,15 +335,17 @@ class DbWrapper:
                 return False
             else:
                 self.logger.info(f"Updating user nonce: {user_public_address}")
-                self.get_collection("users").update_one(
-                    {"publicAddress": user_public_address}, {"$set": {"nonce": nonce}}
+                self.storage.update_user(
+                    address_key(user_public_address), {"nonce": nonce}
                 )
+                self.revocations.set_nonce(address_key(user_public_address), nonce)
                 return True
 
         except Exception as e:
             self.logger.error(f"Failed to update user nonce: {e}")
             return False
 
+    @traced
     def delete_user(self, user_public_address: str) -> bool:
         """
         :param user_public_address: public address of user
@@ -239,15 +357,37 @@ class DbWrapper:
                 return False
             else:
                 self.logger.info(f"Deleting user: {user_public_address}")
-                self.get_collection("users").delete_one(
-                    {"publicAddress": user_public_address}
-                )
+                self.storage.delete_user(address_key(user_public_address))
                 return True
 
         except Exception as e:
             self.logger.error(f"Failed to delete user: {e}")
             return False
 
+    def create_token(
+        self, user_public_address: str, nonce: int, signature: str, admin: bool = False
+    ) -> str:
+        """
+        :param user_public_address: public address of user
+        :param nonce: nonce the user signed
+        :param signature: signature of user
+        :param admin: whether the signature was made for the Admin message
+        :return: JWT token valid for 7 days
+        """
+        payload = {
+            "publicAddress": user_public_address,
+            "signature": signature,
+            "nonce": nonce,
+            "exp": int(str(datetime.timestamp(datetime.now())).split(".")[0])
+            + (60 * 60 * 24 * 7),  # 7 days
+            # (seconds * minutes * hours * days)
+        }
+        if admin:
+            payload["admin"] = True
+
+        return jwt.encode(payload, key=os.environ.get("JWT_SECRET"), algorithm="HS256")
+
+    @traced
     def signature(self, user_public_address: str, signature: str):
         """
         :param user_public_address: public address of user
@@ -264,16 +404,18 @@ class DbWrapper:
 
                     self.logger.info(f"User Signature: {user_public_address}")
 
-                    sign_message = f"""
-                    Authenticating user {user_public_address} with nonce {0}
-                    """
-                    message_hex = encode_defunct(text=sign_message)
-
-                    expected_address = self.web3.eth.account.recover_message(
-                        message_hex, signature=signature
+                    message_hex = encode_defunct(
+                        text=signature_message(user_public_address, 0)
                     )
 
-                    if expected_address == user_public_address:
+                    with span("recover_message"):
+                        expected_address = self.web3.eth.account.recover_message(
+                            message_hex, signature=signature
+                        )
+
+                    if address_key(expected_address) == address_key(
+                        user_public_address
+                    ):
                         self.logger.info(f"Signature is valid: {user_public_address}")
                         self.logger.info(f"Creating user: {user_public_address}")
 
@@ -282,20 +424,7 @@ class DbWrapper:
                         )
 
                         self.update_user_nonce(user_public_address, 1)
-                        token = jwt.encode(
-                            {
-                                "publicAddress": user_public_address,
-                                "signature": signature,
-                                "nonce": 0,
-                                "exp": int(
-                                    str(datetime.timestamp(datetime.now())).split(".")[
-                                        0
-                                    ]
-                                )
-                                + (60 * 60 * 24 * 7)  # 7 days
-                                # (seconds * minutes * hours * days)
-                            }
-                        )
+                        token = self.create_token(user_public_address, 0, signature)
 
                         return {"token": token}
                     else:
@@ -312,32 +441,24 @@ class DbWrapper:
 
                     user = self.get_user_by_public_address(user_public_address)
 
-                    sign_message = f"""
-                    Authenticating user {user['publicAddress']} with nonce {user['nonce']}
-                    """
-                    message_hex = encode_defunct(text=sign_message)
-
-                    expected_address = self.web3.eth.account.recover_message(
-                        message_hex, signature=signature
+                    message_hex = encode_defunct(
+                        text=signature_message(user["publicAddress"], user["nonce"])
                     )
 
-                    if expected_address == user_public_address:
+                    with span("recover_message"):
+                        expected_address = self.web3.eth.account.recover_message(
+                            message_hex, signature=signature
+                        )
+
+                    if address_key(expected_address) == address_key(
+                        user_public_address
+                    ):
                         self.logger.info(f"Signature is valid: {user_public_address}")
 
+                        # Bumping the nonce revokes every older token of the user
                         self.update_user_nonce(user_public_address, user["nonce"] + 1)
-                        token = jwt.encode(
-                            {
-                                "publicAddress": user_public_address,
-                                "signature": signature,
-                                "nonce": user["nonce"],
-                                "exp": int(
-                                    str(datetime.timestamp(datetime.now())).split(".")[
-                                        0
-                                    ]
-                                )
-                                + (60 * 60 * 24 * 7)  # 7 days
-                                # (seconds * minutes * hours * days)
-                            }
+                        token = self.create_token(
+                            user_public_address, user["nonce"], signature
                         )
 
                         return {"token": token}
@@ -355,35 +476,54 @@ class DbWrapper:
             self.logger.error(f"Failed to delete user: {e}")
             return False
 
+    @traced
     def verify(self, token: str) -> bool:
         """
         :param token: token of user
-        :return: boolean indicating success status
+        :return: the decoded token if it is valid, False otherwise
         """
         try:
             self.logger.info(f"Verifying user token: {token}")
 
-            decoded = jwt.decode(
-                token, key=os.environ.get("JWT_SECRET"), algorithms=["HS256"]
-            )
+            with span("jwt.decode"):
+                decoded = jwt.decode(
+                    token, key=os.environ.get("JWT_SECRET"), algorithms=["HS256"]
+                )
 
             if decoded["exp"] > int(
                 str(datetime.timestamp(datetime.now())).split(".")[0]
             ):
+                if self.revocations.needs_refresh():
+                    self.refresh_revocations()
+
+                if self.revocations.is_revoked(
+                    address_key(decoded["publicAddress"]), decoded["nonce"], token
+                ):
+                    self.logger.info(f"Token was revoked: {decoded['publicAddress']}")
+                    return False
+
                 jwt_signature = decoded["signature"]
 
-                sign_message = f"""
-                Authenticating user {decoded["publicAddress"]} with nonce 
-                {decoded["nonce"]}
-                """
-                message_hex = encode_defunct(text=sign_message)
-                user_public_address = self.web3.eth.account.recover_message(
-                    message_hex, signature=jwt_signature
+                message_hex = encode_defunct(
+                    text=signature_message(
+                        decoded["publicAddress"],
+                        decoded["nonce"],
+                        admin=decoded.get("admin", False),
+                    )
                 )
+                with span("recover_message"):
+                    user_public_address = self.web3.eth.account.recover_message(
+                        message_hex, signature=jwt_signature
+                    )
 
                 self.logger.info(
                     f"Decoded User Signature Public Address:" f" {user_public_address}"
                 )
+                if address_key(user_public_address) != address_key(
+                    decoded["publicAddress"]
+                ):
+                    return False
+
                 decoded["publicAddress"] = user_public_address
 
                 return decoded
@@ -394,7 +534,86 @@ class DbWrapper:
             self.logger.error(f"Failed to verify user token: {e}")
             return False
 
+    @traced
+    def revoke_token(self, token: str, exp: int = None) -> bool:
+        """
+        :param token: token of user
+        :param exp: expiry of the token if it was already verified, the token is
+        verified first otherwise
+        :return: boolean indicating success status
+        """
+        try:
+            if exp is None:
+                decoded = self.verify(token)
+                if not decoded:
+                    self.logger.critical("Token is not valid. Cannot be revoked.")
+                    return False
+                exp = decoded["exp"]
+
+            self.logger.info("Revoking token")
+            self.storage.insert_revoked_token(token_id(token), exp)
+            self.revocations.revoke(token_id(token))
+            return True
+
+        except Exception as e:
+            self.logger.error(f"Failed to revoke token: {e}")
+            return False
+
+    def user_nonces(self):
+        """
+        :return: (address key, stored nonce) of every user, users stored with an
+        address that has no key (left behind by app.migrations) are skipped
+        """
+        for user in self.storage.find_users():
+            try:
+                key = address_key(user.get("publicAddress"))
+
+            except (TypeError, ValueError) as e:
+                self.logger.error(f"Skipping user {user.get('_id')}: {e}")
+                continue
+
+            yield key, user.get("nonce", 0)
+
+    def rebuild_revocations(self) -> bool:
+        """
+        Rebuilds the revoked token filter and the nonce index separately, so one
+        failing does not leave the other empty.
+
+        :return: boolean indicating success status
+        """
+        refreshed = self.refresh_revocations()
+
+        try:
+            self.logger.info("Rebuilding user nonce index")
+            self.revocations.rebuild_nonces(self.user_nonces())
+            return refreshed
+
+        except Exception as e:
+            self.logger.error(f"Failed to rebuild user nonce index: {e}")
+            return False
+
+    @traced
+    def refresh_revocations(self) -> bool:
+        """
+        Rebuilds the revoked token filter from storage, dropping expired tokens.
+
+        :return: boolean indicating success status
+        """
+        try:
+            self.logger.info("Refreshing revoked token filter")
+            self.revocations.refresh(
+                lambda: self.storage.find_revoked_tokens(
+                    int(str(datetime.timestamp(datetime.now())).split(".")[0])
+                )
+            )
+            return True
+
+        except Exception as e:
+            self.logger.error(f"Failed to refresh revoked token filter: {e}")
+            return False
+
     # For Admin Dashboard Functions
+    @traced
     def admin_signature(self, user_public_address: str, signature: str):
         """
         :param user_public_address: public address of user
@@ -410,28 +629,25 @@ class DbWrapper:
 
                 user = self.get_user_by_public_address(user_public_address)
 
-                sign_message = f"""
-                Authenticating Admin {user['publicAddress']} with nonce {user['nonce']}
-                """
-                message_hex = encode_defunct(text=sign_message)
-
-                expected_address = self.web3.eth.account.recover_message(
-                    message_hex, signature=signature
+                message_hex = encode_defunct(
+                    text=signature_message(
+                        user["publicAddress"], user["nonce"], admin=True
+                    )
                 )
 
-                if expected_address == user_public_address:
+                with span("recover_message"):
+                    expected_address = self.web3.eth.account.recover_message(
+                        message_hex, signature=signature
+                    )
+
+                if address_key(expected_address) == address_key(user_public_address):
                     self.logger.info(f"Signature is valid: {user_public_address}")
-                    token = jwt.encode(
-                        {
-                            "publicAddress": user_public_address,
-                            "nonce": user["nonce"],
-                            "signature": signature,
-                            "exp": int(
-                                str(datetime.timestamp(datetime.now())).split(".")[0]
-                            )
-                            + (60 * 60 * 24 * 7)  # 7 days
-                            # (seconds * minutes * hours * days)
-                        }
+
+                    # Like signature, so an Admin signature cannot be replayed
+                    # and signing in again revokes older tokens
+                    self.update_user_nonce(user_public_address, user["nonce"] + 1)
+                    token = self.create_token(
+                        user_public_address, user["nonce"], signature, admin=True
                     )
 
                     return {"token": token}
@@ -445,42 +661,17 @@ class DbWrapper:
             self.logger.error(f"Failed to sign Admin: {e}")
             return False
 
+    @traced
     def admin_verify(self, token: str) -> bool:
         """
         :param token: token of user
-        :return: boolean indicating success status
+        :return: the decoded token if it is a valid Admin token, False otherwise
         """
         try:
-            self.logger.info(f"Verifying user token: {token}")
+            decoded = self.verify(token)
 
-            decoded = jwt.decode(
-                token, key=os.environ.get("JWT_SECRET"), algorithms=["HS256"]
-            )
-
-            if decoded["exp"] > int(
-                str(datetime.timestamp(datetime.now())).split(".")[0]
-            ):
-                if decoded["publicAddress"] in os.environ.get("ADMINS"):
-                    jwt_signature = decoded["signature"]
-
-                    sign_message = f"""
-                    Authenticating user {decoded["publicAddress"]} with nonce 
-                    {decoded["nonce"]}
-                    """
-                    message_hex = encode_defunct(text=sign_message)
-                    user_public_address = self.web3.eth.account.recover_message(
-                        message_hex, signature=jwt_signature
-                    )
-
-                    self.logger.info(
-                        f"Decoded User Signature Public Address:"
-                        f" {user_public_address}"
-                    )
-                    decoded["publicAddress"] = user_public_address
-
-                    return decoded
-                else:
-                    return False
+            if decoded and self.is_admin(decoded["publicAddress"]):
+                return decoded
             else:
                 return False
 
@@ -488,17 +679,19 @@ class DbWrapper:
             self.logger.error(f"Failed to verify Admin token: {e}")
             return False
 
+    @traced
     def get_emails(self):
         """
         :return: list of emails
         """
         try:
             self.logger.info(f"Getting all emails")
-            return [i for i in self.get_collection("emails").find()]
+            return [i for i in self.storage.find_emails()]
         except Exception as e:
             self.logger.error(f"Failed to get emails: {e}")
             return False
 
+    @traced
     def set_email(self, email: str):
         """
         :param email: email of user
@@ -506,9 +699,7 @@ class DbWrapper:
         """
         try:
             self.logger.info(f"Setting email: {email}")
-            return (
-                self.get_collection("emails").insert_one({"email": email}).inserted_id
-            )
+            return self.storage.insert_email(email)
         except Exception as e:
             self.logger.error(f"Failed to set email: {e}")
             return False
@@ -1,35 +1,17 @@
 from functools import wraps
 
-from app.models.main import User, Admin
+from app.profiling import span
 
 
-def jwt_admin_control(self, func):
-    @wraps(func)
-    async def wrapper(*args, **kwargs):
-        req = await kwargs["User"].token
-
-        user_token = req["token"]
-        response = self.admin_verify(user_token)
-
-        if response:
-            return await func(*args, **kwargs)
-        else:
-            return "Admin Access Required! You are not authorized to access this page!"
-
-    return wrapper
-
+def traced(func):
+    """
+    Records each call of the decorated DbWrapper method as a "db.<name>" span of
+    the current request trace.
+    """
 
-def jwt_user_control(self, func):
     @wraps(func)
-    async def wrapper(*args, **kwargs):
-        req = await kwargs["info"].json()
-
-        user_token = req["token"]
-        response = self.admin_verify(user_token)
-
-        if response:
-            return await func(*args, **kwargs)
-        else:
-            return "Admin Access Required! You are not authorized to access this page!"
+    def wrapper(*args, **kwargs):
+        with span(f"db.{func.__name__}"):
+            return func(*args, **kwargs)
 
     return wrapper
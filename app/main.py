@@ -1,6 +1,10 @@
-from app.db_wrapper import DbWrapper
+import os
 
-from fastapi import FastAPI, Request, Depends, Form
+from app.auth.main import Authorizer, require_owner
+from app.db_wrapper import DbWrapper, user_revision
+from app.profiling import RequestProfiler, TracedRoute
+
+from fastapi import FastAPI, Request, Response, Depends, Form, HTTPException
 from starlette.middleware.cors import CORSMiddleware
 from typing import Type, Optional
 
@@ -13,10 +17,24 @@ pydantic.json.ENCODERS_BY_TYPE[ObjectId] = str  # Convert ObjectId to string to
 
 from app.models.main import User, Admin
 
-# Create the FastAPI app
-app = FastAPI()
 db = DbWrapper(db_name="test_db")
 
+# Create the FastAPI app, every route is checked against app.auth.main.POLICIES
+authorizer = Authorizer(db)
+app = FastAPI(dependencies=[Depends(authorizer)])
+app.router.route_class = TracedRoute  # Adds parse/endpoint/serialize spans
+
+# Traces every request, keeps slow ones for /admin/slow_requests and profiles
+# requests sent with an Admin token in the X-Profile header
+profiler = RequestProfiler(
+    is_admin_token=authorizer.is_admin_token,  # Authorizer reuses the verification
+    retention=int(os.environ.get("PROFILE_RETENTION", 20)),
+    sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+    slow_ms=float(os.environ.get("SLOW_REQUEST_MS", 500)),
+    buffer_size=int(os.environ.get("SLOW_REQUEST_BUFFER", 100)),
+)
+app.middleware("http")(profiler)
+
 # Add CORS middleware to allow cross-origin requests
 origins = ["http://127.0.0.1:3000", "http://127.0.0.1:8000"]
 
@@ -29,6 +47,27 @@ app.add_middleware(
 )
 
 
+def etag(revision: str) -> str:
+    """
+    :param revision: revision from DbWrapper.get_user_revision
+    :return: the ETag header value of that revision
+    """
+    return f'"{revision}"'
+
+
+def etag_matches(header: str, revision: Optional[str]) -> bool:
+    """
+    :param header: If-Match / If-None-Match value, a list of (weak) tags or *
+    :param revision: current revision of the user, None if it does not exist
+    :return: True if the header matches the revision
+    """
+    if revision is None:
+        return False
+
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag(revision) in [tag.removeprefix("W/") for tag in tags]
+
+
 @app.get("/")
 async def root(info: Request):
     """
@@ -87,7 +126,8 @@ async def set_user(user: User = Depends(User.as_form)) -> str:
     :return: True if user was set, False otherwise
     """
     try:
-        return db.set_user(dict(user))
+        # token is the caller's credential, never part of the stored profile
+        return db.set_user(user.dict(exclude={"token"}))
 
     except Exception as e:
         return e
@@ -95,34 +135,77 @@ async def set_user(user: User = Depends(User.as_form)) -> str:
 
 # Every registered user if free to update their profile with their token passed
 # as an argument as well in the form or the user should be admin.
+# Send the ETag from /get_user as If-Match to only update if nobody else did since.
 # Access: Admin + Registered User
 @app.post("/update_user")
-async def update_user(user: User = Depends(User.as_form)) -> bool:
+async def update_user(
+    request: Request, response: Response, user: User = Depends(User.as_form)
+) -> bool:
     """
+    :param request: incoming request
+    :param response: response whose ETag header is set to the new revision
     :param user: User object
     :return: True if user was updated, False otherwise
     """
-    try:
-        return db.update_user(dict(user))
+    require_owner(request, user.publicAddress)
 
+    expected_version = None
+    if_match = request.headers.get("If-Match")
+    if if_match:
+        revision = db.get_user_revision(user.publicAddress)
+        if not etag_matches(if_match, revision):
+            raise HTTPException(status_code=412, detail="User was modified.")
+        expected_version = int(revision.rsplit("-", 1)[1])
+
+    try:
+        # Only what the client sent, unset fields must not overwrite stored ones
+        changes = user.dict(exclude_unset=True, exclude={"token"})
+        updated = db.update_user(
+            {**changes, "publicAddress": user.publicAddress},
+            expected_version=expected_version,
+        )
     except Exception as e:
         return e
 
+    if if_match and not updated:
+        raise HTTPException(status_code=412, detail="User was modified.")
+
+    if updated:
+        response.headers["ETag"] = etag(db.get_user_revision(user.publicAddress))
+    return updated
+
 
 @app.post("/get_user")  # A specific user data registered in the database by
-# public address
+# public address. Answers 304 to a matching If-None-Match without loading the user.
 # Access: Admin + Registered User
 async def get_user(
-    admin: Admin = Depends(Admin.as_form), public_address: Optional[str] = Form("")
+    request: Request,
+    response: Response,
+    admin: Admin = Depends(Admin.as_form),
+    public_address: Optional[str] = Form(""),
 ) -> str:
     """
+    :param request: incoming request
+    :param response: response whose ETag header is set to the user's revision
     :param admin: Admin object
     :param public_address: public address of the user
     :return: User object
     """
+    require_owner(request, public_address)
     try:
         if public_address:
-            return db.get_user_by_public_address(public_address)
+            if_none_match = request.headers.get("If-None-Match")
+            if if_none_match:
+                revision = db.get_user_revision(public_address)
+                if etag_matches(if_none_match, revision):
+                    return Response(status_code=304, headers={"ETag": etag(revision)})
+
+            user = db.get_user_by_public_address(public_address)
+            if user is not None:
+                response.headers["ETag"] = etag(
+                    user_revision(user["_id"], user.get("version", 0))
+                )
+            return user
         else:
             return False
 
@@ -165,7 +248,7 @@ async def user_verify(
     """
     try:
         if user.publicAddress and token:
-            return db.verify(user.publicAddress, token)
+            return db.verify(token)
         else:
             return False
 
@@ -173,6 +256,22 @@ async def user_verify(
         return e
 
 
+# Revokes the passed token only, signing in again revokes every older token.
+# Access: Admin + Registered User
+@app.post("/user/logout")
+async def user_logout(request: Request) -> bool:
+    """
+    :param request: incoming request
+    :return: True if the token was revoked, False otherwise
+    """
+    try:
+        identity = request.state.identity  # Already verified by Authorizer
+        return db.revoke_token(identity.token, exp=identity.exp)
+
+    except Exception as e:
+        return e
+
+
 # Everybody is allowed to use this endpoint because you can not really hack blockchain
 # yet, so only Admin will be allowed after the backend check in the end.
 # Access: Admin + Registered User + Unregistered User
@@ -209,7 +308,7 @@ async def admin_verify(
     """
     try:
         if admin.publicAddress and token:
-            return db.admin_verify(admin.publicAddress, token)
+            return db.admin_verify(token)
         else:
             return False
 
@@ -247,3 +346,17 @@ async def set_email(user: User = Depends(User.as_form)):
 
     except Exception as e:
         return e
+
+
+# Access: Admin
+@app.post("/admin/slow_requests")
+async def slow_requests(admin: Admin = Depends(Admin.as_form)):
+    """
+    :param admin: Admin object
+    :return: span breakdowns of the most recent slow requests, oldest first
+    """
+    try:
+        return profiler.get_slow_requests()
+
+    except Exception as e:
+        return e
@@ -0,0 +1,184 @@
+"""
+Converts existing user documents to the normalized address layout: a checksum
+`publicAddress` plus the 20-byte binary `addressKey` used for lookups. Documents
+whose addresses differ only by casing are merged, the losers are moved to the
+`users_duplicates` collection.
+
+Usage:
+    python -m app.migrations.main --db test_db --batch-size 1000 [--drop-legacy-index]
+"""
+import argparse
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.db_wrapper import DbWrapper
+from app.models.main import address_key, normalize_address
+from app.storage.mongo import MongoStorage
+
+
+def index_sizes(db: DbWrapper, collection_name: str) -> dict:
+    """
+    :param db: DbWrapper instance
+    :param collection_name: name of collection to inspect
+    :return: a mapping of index name to size in bytes
+    """
+    try:
+        stats = db.storage.database.command("collStats", collection_name)
+        return dict(stats.get("indexSizes", {}))
+
+    except Exception as e:
+        db.logger.error(f"Failed to get index sizes: {e}")
+        return {}
+
+
+def move_duplicates(db: DbWrapper, survivor: dict, duplicates: list) -> int:
+    """
+    Moves user documents that lost a merge to the users_duplicates collection,
+    where they keep all their fields plus the _id of the surviving user.
+
+    :param db: DbWrapper instance backed by MongoStorage
+    :param survivor: the user document that keeps the address
+    :param duplicates: the other user documents with the same address
+    :return: number of documents moved
+    """
+    users = db.storage.collection("users")
+    ids = [duplicate["_id"] for duplicate in duplicates]
+    documents = list(users.find({"_id": {"$in": ids}}))
+    if documents:
+        db.storage.collection("users_duplicates").insert_many(
+            [{**document, "duplicateOf": survivor["_id"]} for document in documents]
+        )
+        users.delete_many({"_id": {"$in": ids}})
+
+    for document in documents:
+        db.logger.warning(
+            f"Merged duplicate user {document['_id']} ({document.get('publicAddress')},"
+            f" nonce {document.get('nonce')}) into {survivor['_id']}"
+        )
+    return len(documents)
+
+
+def migrate_addresses(db: DbWrapper, batch_size: int = 1000) -> dict:
+    """
+    Legacy documents whose addresses differ only by casing map to the same
+    addressKey, so only one of them can keep it. The one with the highest nonce
+    survives (on a tie an already migrated document, then the oldest one) and the
+    others are moved to users_duplicates for review.
+
+    :param db: DbWrapper instance backed by MongoStorage
+    :param batch_size: number of documents converted per bulk write
+    :return: counts of migrated, skipped, merged and failed documents
+    """
+    users = db.storage.collection("users")
+    result = {"migrated": 0, "skipped": 0, "duplicates": 0, "failed": 0}
+    batch = []
+
+    def flush():
+        if not batch:
+            return
+        try:
+            result["migrated"] += users.bulk_write(batch, ordered=False).modified_count
+
+        except BulkWriteError as e:  # The other writes of the batch still went in
+            result["migrated"] += e.details.get("nModified", 0)
+            for error in e.details.get("writeErrors", []):
+                result["failed"] += 1
+                db.logger.error(f"Failed to migrate user: {error.get('errmsg')}")
+
+        db.logger.info(f"Migrated {result['migrated']} users")
+        batch.clear()
+
+    groups = {}  # address key -> legacy documents, oldest first
+    cursor = users.find(
+        {"addressKey": {"$exists": False}},
+        {"publicAddress": 1, "nonce": 1},
+        batch_size=batch_size,
+    ).sort("_id")
+    for user in cursor:
+        try:
+            user["publicAddress"] = normalize_address(user.get("publicAddress"))
+            key = address_key(user["publicAddress"])
+
+        except (TypeError, ValueError) as e:
+            db.logger.error(f"Skipping user {user['_id']}: {e}")
+            result["skipped"] += 1
+            continue
+
+        groups.setdefault(key, []).append(user)
+
+    keys = list(groups)
+    for start in range(0, len(keys), batch_size):
+        chunk = keys[start : start + batch_size]
+        migrated = {
+            user["addressKey"]: user
+            for user in users.find(
+                {"addressKey": {"$in": chunk}}, {"addressKey": 1, "nonce": 1}
+            )
+        }
+
+        for key in chunk:
+            candidates = [migrated[key]] if key in migrated else []
+            candidates += groups[key]
+            # max keeps the first of equal nonces: migrated first, then oldest
+            survivor = max(candidates, key=lambda user: user.get("nonce") or 0)
+            duplicates = [user for user in candidates if user is not survivor]
+            if duplicates:
+                result["duplicates"] += move_duplicates(db, survivor, duplicates)
+
+            if survivor is not migrated.get(key):
+                batch.append(
+                    UpdateOne(
+                        {"_id": survivor["_id"]},
+                        {
+                            "$set": {
+                                "publicAddress": survivor["publicAddress"],
+                                "addressKey": key,
+                            }
+                        },
+                    )
+                )
+                if len(batch) >= batch_size:
+                    flush()
+
+    flush()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default="test_db", help="database name")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--drop-legacy-index",
+        action="store_true",
+        help="drop the old string index on publicAddress once converted",
+    )
+    args = parser.parse_args()
+
+    db = DbWrapper(db_name=args.db)
+    if not isinstance(db.storage, MongoStorage):
+        parser.error("Only MongoDB storage needs migrating, the others key by bytes.")
+
+    print(f"Index sizes before: {index_sizes(db, 'users')}")
+
+    result = migrate_addresses(db, batch_size=args.batch_size)
+    print(
+        f"Migrated: {result['migrated']}, skipped: {result['skipped']}, "
+        f"merged duplicates: {result['duplicates']} (see users_duplicates), "
+        f"failed: {result['failed']}"
+    )
+
+    if not db.ensure_indexes():
+        print("Failed to build the addressKey index, check for duplicate addresses.")
+
+    if args.drop_legacy_index:
+        users = db.storage.collection("users")
+        if "publicAddress_1" in users.index_information():
+            users.drop_index("publicAddress_1")
+
+    print(f"Index sizes after: {index_sizes(db, 'users')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Moves users to the shard the consistent hash ring assigns them to. Run it with
+the new STORAGE_SHARDS list after adding shards, while the API is stopped.
+
+Usage:
+    python -m app.migrations.rebalance --db test_db [--shards "a=url b=url c=url"]
+        [--dry-run]
+"""
+import os
+import argparse
+
+from dotenv import load_dotenv, find_dotenv
+
+from app.storage.sharded import create_sharded_storage, rebalance
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default="test_db", help="base database name")
+    parser.add_argument(
+        "--shards", help='"name=url" pairs, defaults to STORAGE_SHARDS from .env'
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only count the users that would move"
+    )
+    args = parser.parse_args()
+
+    load_dotenv(find_dotenv())
+    spec = args.shards or os.environ.get("STORAGE_SHARDS")
+    if not spec:
+        parser.error("Pass --shards or set STORAGE_SHARDS.")
+
+    storage = create_sharded_storage(spec, args.db)
+    try:
+        result = rebalance(storage, dry_run=args.dry_run)
+    finally:
+        storage.close()
+
+    verb = "Would move" if args.dry_run else "Moved"
+    print(f"{verb} {result['moved']} of {result['scanned']} users")
+    for name in storage.shards:
+        print(f"  {name}: -{result['from'].get(name, 0)} +{result['to'].get(name, 0)}")
+
+
+if __name__ == "__main__":
+    main()
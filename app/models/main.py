@@ -1,25 +1,77 @@
 import inspect
 from typing import Type, Optional
-from fastapi import Form
-from pydantic import BaseModel
+from fastapi import Form, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError, validator
+from eth_utils import is_hex_address, to_checksum_address, to_canonical_address
+
+
+def normalize_address(address: Optional[str]) -> Optional[str]:
+    """
+    :param address: public address in any casing
+    :return: the EIP-55 checksum form of the address, or the address unchanged if
+    it is empty
+    """
+    if not address:
+        return address
+
+    if not is_hex_address(address):
+        raise ValueError(f"Invalid public address: {address}")
+
+    return to_checksum_address(address)
+
+
+def address_key(address: str) -> bytes:
+    """
+    :param address: public address in any casing
+    :return: the 20-byte binary form of the address used as the indexed lookup key
+    """
+    if not is_hex_address(address):
+        raise ValueError(f"Invalid public address: {address}")
+
+    return to_canonical_address(address)
 
 
 def as_form(cls: Type[BaseModel]):
     """
     Adds an as_form class method to decorated models. The as_form class method
-    can be used with FastAPI endpoints
+    can be used with FastAPI endpoints. Fields missing from the form are left
+    unset, so model.dict(exclude_unset=True) holds only what the client sent.
+    FastAPI reports an empty form value the same way as a missing one, so the raw
+    form decides: a field sent empty is set to its default ("" or 0), which is
+    how a client clears it.
     """
     new_params = [
+        inspect.Parameter(
+            "request",
+            inspect.Parameter.POSITIONAL_ONLY,
+            default=None,
+            annotation=Request,
+        )
+    ] + [
         inspect.Parameter(
             field.alias,
             inspect.Parameter.POSITIONAL_ONLY,
-            default=(Form(field.default) if not field.required else Form(...)),
+            default=(Form(None) if not field.required else Form(...)),
         )
         for field in cls.__fields__.values()
     ]
 
-    async def _as_form(**data):
-        return cls(**data)
+    async def _as_form(request: Request = None, **data):
+        form = await request.form() if request is not None else {}
+        values = {}
+        for field in cls.__fields__.values():
+            value = data.get(field.alias)
+            if value is not None:
+                values[field.alias] = value
+            elif field.alias in form:  # Sent, but empty
+                values[field.alias] = field.get_default()
+
+        try:
+            return cls(**values)
+
+        except ValidationError as e:  # Surface as a 422 instead of a 500
+            raise RequestValidationError(e.raw_errors)
 
     sig = inspect.signature(_as_form)
     sig = sig.replace(parameters=new_params)
@@ -42,8 +94,28 @@ class User(BaseModel):
     points: Optional[int] = 0
     token: Optional[str] = ""
 
+    _normalize_public_address = validator("publicAddress", allow_reuse=True)(
+        normalize_address
+    )
+
 
 @as_form
 class Admin(BaseModel):
     publicAddress: Optional[str] = ""
     token: Optional[str] = ""
+
+    _normalize_public_address = validator("publicAddress", allow_reuse=True)(
+        normalize_address
+    )
+
+
+class Identity(BaseModel):
+    """
+    The verified caller of a request, see app.auth.main.Authorizer.
+    """
+
+    publicAddress: str
+    nonce: int
+    admin: bool = False
+    token: str
+    exp: int
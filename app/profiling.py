@@ -0,0 +1,314 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+from typing import Callable, Optional
+
+from fastapi.routing import APIRoute
+
+# Trace of the request being handled, None outside of a request
+current_trace: ContextVar[Optional["RequestTrace"]] = ContextVar(
+    "current_trace", default=None
+)
+
+
+class RequestTrace:
+    """
+    Timeline of one request: where the time went between parsing, DbWrapper
+    calls, the endpoint itself and serializing the response.
+    """
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started_at = datetime.now().isoformat()
+        self.start = time.perf_counter()
+        self.end = None
+        self.endpoint_end = None
+        self.depth = 0
+        self.spans = []  # (name, start offset ms, duration ms, depth)
+        self.tasks = set()  # asyncio tasks running this request
+
+    def add(self, name: str, start: float, end: float, depth: int = 0) -> None:
+        self.spans.append(
+            (name, (start - self.start) * 1000, (end - start) * 1000, depth)
+        )
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start) * 1000
+
+    def summary(self) -> dict:
+        """
+        :return: the trace as a JSON serializable dict
+        """
+        return {
+            "method": self.method,
+            "path": self.path,
+            "startedAt": self.started_at,
+            "durationMs": round(self.duration_ms, 3),
+            "spans": [
+                {
+                    "name": name,
+                    "startMs": round(start, 3),
+                    "durationMs": round(duration, 3),
+                    "depth": depth,
+                }
+                for name, start, duration, depth in sorted(
+                    self.spans, key=lambda span: span[1]
+                )
+            ],
+        }
+
+
+@contextmanager
+def span(name: str):
+    """
+    Records the enclosed block as a span of the current request, if any.
+    """
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    trace.depth += 1
+    try:
+        yield
+    finally:
+        trace.depth -= 1
+        trace.add(name, start, time.perf_counter(), trace.depth)
+
+
+def traced_endpoint(endpoint: Callable) -> Callable:
+    """
+    Wraps an async endpoint to record the "parse" span (everything FastAPI did
+    before calling it: reading the body, form parsing, validation) and the
+    endpoint span itself.
+    """
+
+    @wraps(endpoint)  # FastAPI resolves dependencies through __wrapped__
+    async def wrapper(*args, **kwargs):
+        trace = current_trace.get()
+        if trace is None:
+            return await endpoint(*args, **kwargs)
+
+        start = time.perf_counter()
+        trace.add("parse", trace.start, start)
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            trace.endpoint_end = time.perf_counter()
+            trace.add("endpoint", start, trace.endpoint_end)
+
+    return wrapper
+
+
+class TracedRoute(APIRoute):
+    """
+    Route class adding parse / endpoint / serialize spans to the current trace.
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, traced_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def traced_handler(request):
+            trace = current_trace.get()
+            if trace is not None:
+                # call_next of the middleware runs the app in a task of its own
+                trace.tasks.add(asyncio.current_task())
+            response = await handler(request)
+            if trace is not None and trace.endpoint_end is not None:
+                trace.add("serialize", trace.endpoint_end, time.perf_counter())
+            return response
+
+        return traced_handler
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread at a fixed interval from a background thread
+    and aggregates the samples as folded stacks (the input format of
+    flamegraph.pl and speedscope).
+
+    Every request runs on the event loop thread, so when loop and tasks are given
+    only samples taken while one of tasks is running are kept; the stacks of
+    other requests handled meanwhile are counted in skipped.
+    """
+
+    def __init__(
+        self,
+        thread_id: int,
+        interval: float = 0.001,
+        loop: asyncio.AbstractEventLoop = None,
+        tasks: set = None,
+    ):
+        """
+        :param thread_id: ident of the thread to sample
+        :param interval: seconds between samples
+        :param loop: event loop running on the thread
+        :param tasks: tasks of loop to keep samples of, may grow while sampling
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.loop = loop
+        self.tasks = tasks
+        self.samples = Counter()
+        self.skipped = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def current_task(self) -> Optional[asyncio.Task]:
+        return asyncio.current_task(self.loop) if self.loop is not None else None
+
+    def _run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            task = self.current_task()
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                    f":{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            # The loop may have switched tasks while the stack was read
+            if self.tasks is not None and (
+                task not in self.tasks or self.current_task() is not task
+            ):
+                self.skipped += 1
+                continue
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.items())
+
+
+class RequestProfiler:
+    """
+    HTTP middleware that traces every request, keeps the traces of slow ones in a
+    ring buffer and runs the SamplingProfiler on requests that ask for it with an
+    Admin token in the X-Profile header, or are picked by the sample rate.
+    """
+
+    def __init__(
+        self,
+        is_admin_token: Callable[[str], bool],
+        directory: str = "./app/logs/profiles",
+        retention: int = 20,
+        sample_rate: float = 0.0,
+        slow_ms: float = 500.0,
+        buffer_size: int = 100,
+        interval: float = 0.001,
+    ):
+        """
+        :param is_admin_token: called with the request and its X-Profile token,
+        returns True if the token belongs to an Admin
+        :param directory: where profiles are written
+        :param retention: number of profiles kept, oldest are deleted first
+        :param sample_rate: fraction of requests profiled without the header
+        :param slow_ms: requests taking at least this long are kept in the buffer
+        :param buffer_size: number of slow request traces kept
+        :param interval: seconds between profiler samples
+        """
+        self.is_admin_token = is_admin_token
+        self.directory = directory
+        self.retention = retention
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.slow_requests = deque(maxlen=buffer_size)
+
+    def should_profile(self, request) -> bool:
+        token = request.headers.get("X-Profile")
+        if token:
+            return bool(self.is_admin_token(request, token))
+
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def save_profile(self, profiler: SamplingProfiler, trace: RequestTrace) -> str:
+        """
+        :return: path of the written profile
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        name = "-".join(
+            [
+                datetime.now().strftime("%Y%m%d%H%M%S%f"),
+                trace.method,
+                trace.path.strip("/").replace("/", "_") or "root",
+                f"{trace.duration_ms:.0f}ms",
+            ]
+        )
+        path = os.path.join(self.directory, f"{name}.folded")
+        with open(path, "w") as f:
+            f.write(profiler.folded())
+
+        with self.lock:
+            profiles = sorted(
+                os.path.join(self.directory, file)
+                for file in os.listdir(self.directory)
+                if file.endswith(".folded")
+            )
+            for old in profiles[: max(0, len(profiles) - self.retention)]:
+                os.remove(old)
+
+        return path
+
+    def get_slow_requests(self) -> list:
+        """
+        :return: traces of the most recent slow requests, oldest first
+        """
+        with self.lock:
+            return list(self.slow_requests)
+
+    async def __call__(self, request, call_next):
+        trace = RequestTrace(request.method, request.url.path)
+        context_token = current_trace.set(trace)
+
+        profiler = None
+        if self.should_profile(request):
+            # Endpoints and DbWrapper run on the event loop thread, shared with
+            # every other request, so only this request's tasks are sampled
+            trace.tasks.add(asyncio.current_task())
+            profiler = SamplingProfiler(
+                threading.get_ident(),
+                self.interval,
+                asyncio.get_running_loop(),
+                trace.tasks,
+            )
+            profiler.start()
+
+        try:
+            return await call_next(request)
+
+        finally:
+            trace.end = time.perf_counter()
+            current_trace.reset(context_token)
+
+            if profiler is not None:
+                profiler.stop()
+                self.save_profile(profiler, trace)
+
+            if trace.duration_ms >= self.slow_ms:
+                with self.lock:
+                    self.slow_requests.append(trace.summary())
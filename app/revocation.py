@@ -0,0 +1,178 @@
+import math
+import time
+import hashlib
+import threading
+from typing import Callable, Iterable
+
+
+class BloomFilter:
+    """
+    Fixed-size approximate set. Membership tests never miss an added item and
+    report a false positive with roughly error_rate probability while at most
+    capacity items have been added; past that the false-positive rate grows but
+    memory does not.
+    """
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 0.001):
+        """
+        :param capacity: number of items the error rate is sized for
+        :param error_rate: target false-positive probability at capacity
+        """
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: bytes):
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        # Kirsch-Mitzenmacher: k positions from two independent hashes
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, item: bytes) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: bytes) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+
+def token_id(token: str) -> bytes:
+    """
+    :param token: JWT token
+    :return: the digest revoked tokens are recorded under
+    """
+    return hashlib.sha256(token.encode()).digest()
+
+
+class RevocationIndex:
+    """
+    In-process view of which tokens are no longer accepted, so verification does
+    not need a database read.
+
+    A token carries the nonce the user signed. Signing in again bumps the stored
+    nonce, after which only the token for the latest nonce is valid; min_nonce
+    maps each address key to that lowest accepted nonce. Individually revoked
+    tokens go into a Bloom filter, so a small fraction of valid tokens may be
+    rejected but a revoked one is never accepted.
+
+    A Bloom filter cannot forget, so the revoked token filter is rebuilt from
+    the unexpired revocations in storage once it is full or older than
+    refresh_interval. That drops expired tokens and picks up revocations made by
+    other processes. min_nonce only sees writes made through this process and is
+    rebuilt from storage at startup.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 100_000,
+        error_rate: float = 0.001,
+        refresh_interval: float = 3600,
+    ):
+        """
+        :param capacity: number of individually revoked tokens to size for
+        :param error_rate: false-positive probability of the revoked token filter
+        :param refresh_interval: seconds after which the revoked token filter is
+        rebuilt from storage
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.min_nonce = {}  # address key -> lowest nonce still accepted
+        self.revoked = BloomFilter(capacity, error_rate)
+        self.refreshed_at = time.monotonic()
+        self.revoked_during_refresh = None  # set while a refresh reads storage
+
+    def set_nonce(self, key: bytes, nonce: int) -> None:
+        """
+        :param key: address key of user
+        :param nonce: the nonce just stored for the user, the next one to be signed
+        """
+        with self.lock:
+            if nonce > 1:  # Every token is valid for nonce <= 1, keep the map small
+                self.min_nonce[key] = nonce - 1
+            else:
+                self.min_nonce.pop(key, None)
+
+    def revoke(self, revoked_token_id: bytes) -> None:
+        """
+        :param revoked_token_id: digest from token_id
+        """
+        with self.lock:
+            self.revoked.add(revoked_token_id)
+            if self.revoked_during_refresh is not None:
+                self.revoked_during_refresh.append(revoked_token_id)
+
+    def is_revoked(self, key: bytes, nonce: int, token: str) -> bool:
+        """
+        :param key: address key of the token's user
+        :param nonce: nonce claimed by the token
+        :param token: JWT token
+        :return: True if the token must be rejected
+        """
+        return nonce < self.min_nonce.get(key, 0) or token_id(token) in self.revoked
+
+    def needs_refresh(self) -> bool:
+        """
+        :return: True if the revoked token filter is full or due for a rebuild
+        """
+        return (
+            self.revoked.count >= self.revoked.capacity
+            or time.monotonic() - self.refreshed_at >= self.refresh_interval
+        )
+
+    def _build_filter(self, revoked_token_ids: Iterable[bytes]) -> BloomFilter:
+        revoked_token_ids = list(revoked_token_ids)
+        # Leave room to grow if more tokens are live than the configured capacity
+        capacity = max(self.capacity, 2 * len(revoked_token_ids))
+        revoked = BloomFilter(capacity, self.error_rate)
+        for revoked_token_id in revoked_token_ids:
+            revoked.add(revoked_token_id)
+        return revoked
+
+    def refresh(self, load_revoked_token_ids: Callable[[], Iterable[bytes]]) -> bool:
+        """
+        Rebuilds the revoked token filter. Tokens revoked while storage is read are
+        carried over, and concurrent callers skip instead of rebuilding twice.
+
+        :param load_revoked_token_ids: returns digests of revoked, unexpired tokens
+        :return: True if this call rebuilt the filter
+        """
+        if not self.refresh_lock.acquire(blocking=False):
+            return False
+
+        try:
+            with self.lock:
+                self.revoked_during_refresh = []
+            revoked = self._build_filter(load_revoked_token_ids())
+
+            with self.lock:
+                for revoked_token_id in self.revoked_during_refresh:
+                    revoked.add(revoked_token_id)
+                self.revoked = revoked
+                self.refreshed_at = time.monotonic()
+            return True
+
+        finally:
+            with self.lock:
+                self.revoked_during_refresh = None
+            self.refresh_lock.release()
+
+    def rebuild_nonces(self, users: Iterable[tuple]) -> None:
+        """
+        Replaces min_nonce, the revoked token filter is rebuilt by refresh.
+
+        :param users: (address key, stored nonce) pairs
+        """
+        min_nonce = {key: nonce - 1 for key, nonce in users if nonce > 1}
+
+        with self.lock:
+            self.min_nonce = min_nonce
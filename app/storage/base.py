@@ -0,0 +1,149 @@
+from abc import ABC, abstractmethod
+from typing import Iterator, Optional
+
+
+class DuplicateUserError(Exception):
+    """
+    Raised by Storage.insert_user when a user with the same address key exists.
+    """
+
+
+class Storage(ABC):
+    """
+    The persistence interface DbWrapper is written against. Users are addressed by
+    the 20-byte binary key from app.models.main.address_key and returned as plain
+    dicts without that key. Every user carries a "version" that starts at 1 and
+    is incremented by each update; documents written before versioning read as 0.
+    """
+
+    @abstractmethod
+    def database_names(self) -> list:
+        """
+        :return: a list of all database names
+        """
+
+    @abstractmethod
+    def collection_names(self) -> list:
+        """
+        :return: a list of all collection names
+        """
+
+    @abstractmethod
+    def ensure_indexes(self) -> None:
+        """
+        Creates whatever indexes the backend needs for key lookups.
+        """
+
+    @abstractmethod
+    def find_users(self) -> Iterator[dict]:
+        """
+        :return: an iterator over all users, ordered by address key
+        """
+
+    @abstractmethod
+    def find_user(self, key: bytes) -> Optional[dict]:
+        """
+        :param key: address key of user
+        :return: user info, None if the user does not exist
+        """
+
+    @abstractmethod
+    def find_user_revision(self, key: bytes) -> Optional[tuple]:
+        """
+        Reads only _id and version, for answering conditional requests without
+        loading the whole user.
+
+        :param key: address key of user
+        :return: (_id, version) of the user, None if the user does not exist
+        """
+
+    @abstractmethod
+    def user_exists(self, key: bytes) -> bool:
+        """
+        :param key: address key of user
+        :return: True if user exists, False otherwise
+        """
+
+    @abstractmethod
+    def insert_user(self, key: bytes, user_info: dict):
+        """
+        :param key: address key of user
+        :param user_info: the user info to store, stored with version 1
+        :return: the id of the inserted user
+        """
+
+    @abstractmethod
+    def update_user(
+        self, key: bytes, fields: dict, expected_version: int = None
+    ) -> Optional[int]:
+        """
+        :param key: address key of user
+        :param fields: the fields to set
+        :param expected_version: only update if the user is still at this version
+        :return: the new version of the user, None if no user was matched
+        """
+
+    @abstractmethod
+    def delete_user(self, key: bytes) -> bool:
+        """
+        :param key: address key of user
+        :return: True if a user was deleted, False otherwise
+        """
+
+    @abstractmethod
+    def find_emails(self) -> Iterator[dict]:
+        """
+        :return: an iterator over all emails, ordered by _id
+        """
+
+    @abstractmethod
+    def insert_email(self, email: str):
+        """
+        :param email: email to store
+        :return: the id of the inserted email
+        """
+
+    @abstractmethod
+    def insert_revoked_token(self, token_id: bytes, exp: int) -> None:
+        """
+        :param token_id: digest of the revoked token
+        :param exp: expiry of the token as a unix timestamp, after which the record
+        can be dropped
+        """
+
+    @abstractmethod
+    def find_revoked_tokens(self, now: int) -> Iterator[bytes]:
+        """
+        :param now: current unix timestamp
+        :return: an iterator over digests of revoked tokens that have not expired
+        """
+
+    def close(self) -> None:
+        """
+        Releases any connections held by the backend.
+        """
+
+
+def create_storage(url: str, db_name: str) -> Storage:
+    """
+    :param url: storage url, one of "memory://", "sqlite:///path/to/file.db" or a
+    MongoDB connection string, None connects to MongoDB on localhost
+    :param db_name: name of database to use
+    :return: storage object
+    """
+    url = url or None  # MongoClient(None) connects to localhost:27017
+    if url and url.startswith("memory://"):
+        from app.storage.memory import MemoryStorage
+
+        return MemoryStorage(db_name=db_name)
+
+    if url and url.startswith("sqlite://"):
+        from app.storage.sqlite import SqliteStorage
+
+        # sqlite:///relative.db, sqlite:////absolute.db, plain sqlite:// is in-memory
+        path = url[len("sqlite:///") :] if url.startswith("sqlite:///") else ""
+        return SqliteStorage(path=path or ":memory:")
+
+    from app.storage.mongo import MongoStorage
+
+    return MongoStorage(url=url, db_name=db_name)
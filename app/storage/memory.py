@@ -0,0 +1,113 @@
+import threading
+from typing import Iterator, Optional
+
+from bson.objectid import ObjectId
+
+from app.storage.base import DuplicateUserError, Storage
+
+
+class MemoryStorage(Storage):
+    """
+    Process-local storage: documents live in a dict keyed by _id and a second dict
+    indexes them by address key. Meant for tests and small single-process
+    deployments, nothing survives a restart.
+    """
+
+    def __init__(self, db_name: str = "test_db"):
+        """
+        :param db_name: name reported by database_names
+        """
+        self.db_name = db_name
+        self.lock = threading.RLock()
+        self.users = {}  # _id -> user info
+        self.user_index = {}  # address key -> _id
+        self.emails = {}  # _id -> email document
+        self.revoked_tokens = {}  # token digest -> expiry
+
+    def database_names(self) -> list:
+        return [self.db_name]
+
+    def collection_names(self) -> list:
+        return ["users", "emails", "revoked_tokens"]
+
+    def ensure_indexes(self) -> None:
+        pass  # user_index is maintained on every write
+
+    def find_users(self) -> Iterator[dict]:
+        with self.lock:
+            users = [
+                dict(self.users[user_id])
+                for _, user_id in sorted(self.user_index.items())
+            ]
+        return iter(users)
+
+    def find_user(self, key: bytes) -> Optional[dict]:
+        with self.lock:
+            user_id = self.user_index.get(key)
+            return dict(self.users[user_id]) if user_id is not None else None
+
+    def find_user_revision(self, key: bytes) -> Optional[tuple]:
+        with self.lock:
+            user_id = self.user_index.get(key)
+            if user_id is None:
+                return None
+            return user_id, self.users[user_id].get("version", 0)
+
+    def user_exists(self, key: bytes) -> bool:
+        return key in self.user_index
+
+    def insert_user(self, key: bytes, user_info: dict):
+        with self.lock:
+            if key in self.user_index:
+                raise DuplicateUserError(f"User already exists: {key.hex()}")
+
+            user_id = ObjectId()
+            self.users[user_id] = {**user_info, "_id": user_id, "version": 1}
+            self.user_index[key] = user_id
+            return user_id
+
+    def update_user(
+        self, key: bytes, fields: dict, expected_version: int = None
+    ) -> Optional[int]:
+        with self.lock:
+            user_id = self.user_index.get(key)
+            if user_id is None:
+                return None
+
+            user = self.users[user_id]
+            version = user.get("version", 0)
+            if expected_version is not None and version != expected_version:
+                return None
+
+            user.update(fields)
+            user["version"] = version + 1
+            return user["version"]
+
+    def delete_user(self, key: bytes) -> bool:
+        with self.lock:
+            user_id = self.user_index.pop(key, None)
+            if user_id is None:
+                return False
+
+            del self.users[user_id]
+            return True
+
+    def find_emails(self) -> Iterator[dict]:
+        with self.lock:
+            emails = [dict(self.emails[email_id]) for email_id in sorted(self.emails)]
+        return iter(emails)
+
+    def insert_email(self, email: str):
+        with self.lock:
+            email_id = ObjectId()
+            self.emails[email_id] = {"_id": email_id, "email": email}
+            return email_id
+
+    def insert_revoked_token(self, token_id: bytes, exp: int) -> None:
+        with self.lock:
+            self.revoked_tokens[token_id] = exp
+
+    def find_revoked_tokens(self, now: int) -> Iterator[bytes]:
+        with self.lock:
+            token_ids = [t for t, exp in self.revoked_tokens.items() if exp > now]
+        return iter(token_ids)
@@ -0,0 +1,121 @@
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.storage.base import DuplicateUserError, Storage
+
+
+class MongoStorage(Storage):
+    def __init__(self, url: str = None, db_name: str = "test_db", client=None):
+        """
+        :param url: MongoDB connection string
+        :param db_name: name of database to use
+        :param client: an existing MongoClient (or compatible) to use instead of url
+        """
+        self.client = client if client is not None else MongoClient(url)
+        self.db_name = db_name
+        self.database = self.client[db_name]
+
+    def collection(self, collection_name: str):
+        """
+        :param collection_name: name of collection to get
+        :return: collection object
+        """
+        return self.database[collection_name]
+
+    def database_names(self) -> list:
+        return self.client.list_database_names()
+
+    def collection_names(self) -> list:
+        return self.database.list_collection_names()
+
+    def ensure_indexes(self) -> None:
+        # Partial so documents not yet migrated by app.migrations do not collide
+        self.collection("users").create_index(
+            "addressKey",
+            unique=True,
+            partialFilterExpression={"addressKey": {"$exists": True}},
+        )
+        self.collection("revoked_tokens").create_index("tokenId", unique=True)
+        # TTL index, MongoDB drops records once the token has expired anyway
+        self.collection("revoked_tokens").create_index("expireAt", expireAfterSeconds=0)
+
+    def find_users(self) -> Iterator[dict]:
+        return self.collection("users").find({}, {"addressKey": 0}).sort("addressKey")
+
+    def find_user(self, key: bytes) -> Optional[dict]:
+        return self.collection("users").find_one({"addressKey": key}, {"addressKey": 0})
+
+    def find_user_revision(self, key: bytes) -> Optional[tuple]:
+        user = self.collection("users").find_one({"addressKey": key}, {"version": 1})
+        return (user["_id"], user.get("version", 0)) if user else None
+
+    def user_exists(self, key: bytes) -> bool:
+        return (
+            self.collection("users").find_one({"addressKey": key}, {"_id": 1})
+            is not None
+        )
+
+    def insert_user(self, key: bytes, user_info: dict):
+        try:
+            return (
+                self.collection("users")
+                .insert_one({**user_info, "addressKey": key, "version": 1})
+                .inserted_id
+            )
+
+        except DuplicateKeyError as e:
+            raise DuplicateUserError(str(e))
+
+    def update_user(
+        self, key: bytes, fields: dict, expected_version: int = None
+    ) -> Optional[int]:
+        query = {"addressKey": key}
+        if expected_version == 0:  # Documents written before versioning
+            query["version"] = {"$in": [0, None]}
+        elif expected_version is not None:
+            query["version"] = expected_version
+
+        user = self.collection("users").find_one_and_update(
+            query,
+            {"$set": fields, "$inc": {"version": 1}},
+            projection={"version": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        return user["version"] if user else None
+
+    def delete_user(self, key: bytes) -> bool:
+        return (
+            self.collection("users").delete_one({"addressKey": key}).deleted_count == 1
+        )
+
+    def find_emails(self) -> Iterator[dict]:
+        return self.collection("emails").find().sort("_id")
+
+    def insert_email(self, email: str):
+        return self.collection("emails").insert_one({"email": email}).inserted_id
+
+    def insert_revoked_token(self, token_id: bytes, exp: int) -> None:
+        self.collection("revoked_tokens").update_one(
+            {"tokenId": token_id},
+            {
+                "$set": {
+                    "exp": exp,
+                    "expireAt": datetime.fromtimestamp(exp, tz=timezone.utc),
+                }
+            },
+            upsert=True,
+        )
+
+    def find_revoked_tokens(self, now: int) -> Iterator[bytes]:
+        return (
+            record["tokenId"]
+            for record in self.collection("revoked_tokens").find(
+                {"exp": {"$gt": now}}, {"tokenId": 1}
+            )
+        )
+
+    def close(self) -> None:
+        self.client.close()
@@ -0,0 +1,221 @@
+import heapq
+import itertools
+from bisect import bisect_right
+from hashlib import blake2b
+from typing import Iterator, Optional
+
+from app.models.main import address_key
+from app.storage.base import DuplicateUserError, Storage, create_storage
+
+
+def ring_hash(data: bytes) -> int:
+    """
+    :param data: bytes to place on the ring
+    :return: a 64-bit position on the ring
+    """
+    return int.from_bytes(blake2b(data, digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring. Every shard owns `replicas` virtual nodes placed by the
+    hash of its name, so adding a shard only moves the keys that land on the new
+    shard's nodes (about 1/N of them) and leaves every other key where it was.
+    """
+
+    def __init__(self, names: list, replicas: int = 128):
+        """
+        :param names: names of the shards, the placement depends only on these
+        :param replicas: number of virtual nodes per shard
+        """
+        if not names:
+            raise ValueError("A hash ring needs at least one shard")
+
+        nodes = sorted(
+            (ring_hash(f"{name}#{i}".encode()), name)
+            for name in names
+            for i in range(replicas)
+        )
+        self.points = [point for point, _ in nodes]
+        self.names = [name for _, name in nodes]
+
+    def owner(self, key: bytes) -> str:
+        """
+        :param key: key to place
+        :return: name of the shard owning the key
+        """
+        index = bisect_right(self.points, ring_hash(key))
+        return self.names[index % len(self.names)]
+
+
+class ShardedStorage(Storage):
+    """
+    Routes every user by its address key to one of several storage backends.
+    Single-user operations touch only the owning shard; scans read all shards and
+    merge their already ordered results lazily, so no shard is read ahead of the
+    consumer. Emails and revoked tokens are spread by their own hash, they are
+    only ever read back by full scans.
+    """
+
+    def __init__(self, shards: dict, replicas: int = 128):
+        """
+        :param shards: a mapping of shard name to Storage
+        :param replicas: number of virtual nodes per shard
+        """
+        self.shards = dict(shards)
+        self.ring = HashRing(list(self.shards), replicas=replicas)
+
+    def shard_name(self, key: bytes) -> str:
+        """
+        :param key: address key of user
+        :return: name of the shard owning the user
+        """
+        return self.ring.owner(key)
+
+    def shard(self, key: bytes) -> Storage:
+        """
+        :param key: address key of user
+        :return: the shard owning the user
+        """
+        return self.shards[self.ring.owner(key)]
+
+    def database_names(self) -> list:
+        names = set()
+        for shard in self.shards.values():
+            names.update(shard.database_names())
+        return sorted(names)
+
+    def collection_names(self) -> list:
+        names = set()
+        for shard in self.shards.values():
+            names.update(shard.collection_names())
+        return sorted(names)
+
+    def ensure_indexes(self) -> None:
+        for shard in self.shards.values():
+            shard.ensure_indexes()
+
+    def find_users(self) -> Iterator[dict]:
+        # Lowercase hex orders exactly like the 20-byte address key
+        return heapq.merge(
+            *(shard.find_users() for shard in self.shards.values()),
+            key=lambda user: user["publicAddress"].lower(),
+        )
+
+    def find_user(self, key: bytes) -> Optional[dict]:
+        return self.shard(key).find_user(key)
+
+    def find_user_revision(self, key: bytes) -> Optional[tuple]:
+        return self.shard(key).find_user_revision(key)
+
+    def user_exists(self, key: bytes) -> bool:
+        return self.shard(key).user_exists(key)
+
+    def insert_user(self, key: bytes, user_info: dict):
+        return self.shard(key).insert_user(key, user_info)
+
+    def update_user(
+        self, key: bytes, fields: dict, expected_version: int = None
+    ) -> Optional[int]:
+        return self.shard(key).update_user(key, fields, expected_version)
+
+    def delete_user(self, key: bytes) -> bool:
+        return self.shard(key).delete_user(key)
+
+    def find_emails(self) -> Iterator[dict]:
+        # ObjectIds start with their creation time, so this is insertion order
+        return heapq.merge(
+            *(shard.find_emails() for shard in self.shards.values()),
+            key=lambda email: email["_id"],
+        )
+
+    def insert_email(self, email: str):
+        return self.shards[self.ring.owner(email.encode())].insert_email(email)
+
+    def insert_revoked_token(self, token_id: bytes, exp: int) -> None:
+        self.shards[self.ring.owner(token_id)].insert_revoked_token(token_id, exp)
+
+    def find_revoked_tokens(self, now: int) -> Iterator[bytes]:
+        return itertools.chain.from_iterable(
+            shard.find_revoked_tokens(now) for shard in self.shards.values()
+        )
+
+    def close(self) -> None:
+        for shard in self.shards.values():
+            shard.close()
+
+
+def parse_shards(spec: str) -> dict:
+    """
+    :param spec: whitespace separated "name=url" pairs, e.g.
+    "a=mongodb://host-a b=mongodb://host-b". A url may end in "#database" to pick
+    the database of that shard, e.g. "old=mongodb://host-a#test_db"
+    :return: a mapping of shard name to (storage url, database name or None)
+    """
+    shards = {}
+    for entry in spec.split():
+        name, separator, url = entry.partition("=")
+        url, _, database = url.partition("#")
+        if not separator or not name or not url:
+            raise ValueError(f"Expected name=url, got: {entry}")
+        if name in shards:
+            raise ValueError(f"Duplicate shard name: {name}")
+        shards[name] = (url, database or None)
+    return shards
+
+
+def create_sharded_storage(spec: str, db_name: str) -> ShardedStorage:
+    """
+    :param spec: shard list as accepted by parse_shards
+    :param db_name: base database name, shards without their own database use
+    "<db_name>_<shard name>" so several shards can share one MongoDB deployment
+    :return: sharded storage object
+    """
+    return ShardedStorage(
+        {
+            name: create_storage(url, database or f"{db_name}_{name}")
+            for name, (url, database) in parse_shards(spec).items()
+        }
+    )
+
+
+def rebalance(storage: ShardedStorage, dry_run: bool = False) -> dict:
+    """
+    Moves every user that is not on the shard the ring assigns it to. Run it after
+    adding shards, while writes are paused: a user is copied to its new owner
+    before being deleted from the old one, so an interrupted run only leaves
+    stale copies that the next run removes. Moved users get a new _id and start
+    over at version 1, which invalidates any ETags clients hold for them.
+
+    :param storage: sharded storage with the new shard list
+    :param dry_run: only count the users that would move
+    :return: counts of moved users per source and target shard, and the total
+    """
+    result = {"moved": 0, "scanned": 0, "from": {}, "to": {}}
+
+    for name, shard in storage.shards.items():
+        # Materialized first, the loop below deletes from the shard being scanned
+        misplaced = []
+        for user in shard.find_users():
+            result["scanned"] += 1
+            key = address_key(user["publicAddress"])
+            if storage.shard_name(key) != name:
+                misplaced.append((key, user))
+
+        for key, user in misplaced:
+            target = storage.shard_name(key)
+            if not dry_run:
+                user_info = {
+                    k: v for k, v in user.items() if k not in ("_id", "version")
+                }
+                try:
+                    storage.shards[target].insert_user(key, user_info)
+                except DuplicateUserError:
+                    pass  # copied by an earlier, interrupted run
+                shard.delete_user(key)
+
+            result["moved"] += 1
+            result["from"][name] = result["from"].get(name, 0) + 1
+            result["to"][target] = result["to"].get(target, 0) + 1
+
+    return result
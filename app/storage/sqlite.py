@@ -0,0 +1,173 @@
+import json
+import sqlite3
+import threading
+from typing import Iterator, Optional
+
+from bson.objectid import ObjectId
+
+from app.storage.base import DuplicateUserError, Storage
+
+# Statements are module constants so sqlite3's per-connection statement cache
+# compiles each of them once and reuses the prepared statement afterwards.
+CREATE_USERS = """
+CREATE TABLE IF NOT EXISTS users (
+    address_key BLOB PRIMARY KEY,
+    id TEXT NOT NULL,
+    doc TEXT NOT NULL
+) WITHOUT ROWID
+"""
+CREATE_EMAILS = """
+CREATE TABLE IF NOT EXISTS emails (
+    id TEXT PRIMARY KEY,
+    email TEXT NOT NULL
+)
+"""
+CREATE_REVOKED_TOKENS = """
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    token_id BLOB PRIMARY KEY,
+    exp INTEGER NOT NULL
+) WITHOUT ROWID
+"""
+SELECT_USERS = "SELECT id, doc FROM users ORDER BY address_key"
+SELECT_USER = "SELECT id, doc FROM users WHERE address_key = ?"
+SELECT_USER_REVISION = (
+    "SELECT id, json_extract(doc, '$.version') FROM users WHERE address_key = ?"
+)
+SELECT_USER_EXISTS = "SELECT 1 FROM users WHERE address_key = ?"
+INSERT_USER = "INSERT INTO users (address_key, id, doc) VALUES (?, ?, ?)"
+UPDATE_USER = "UPDATE users SET doc = ? WHERE address_key = ?"
+DELETE_USER = "DELETE FROM users WHERE address_key = ?"
+SELECT_EMAILS = "SELECT id, email FROM emails ORDER BY id"
+INSERT_EMAIL = "INSERT INTO emails (id, email) VALUES (?, ?)"
+INSERT_REVOKED_TOKEN = (
+    "INSERT OR REPLACE INTO revoked_tokens (token_id, exp) VALUES (?, ?)"
+)
+SELECT_REVOKED_TOKENS = "SELECT token_id FROM revoked_tokens WHERE exp > ?"
+DELETE_EXPIRED_TOKENS = "DELETE FROM revoked_tokens WHERE exp <= ?"
+
+
+class SqliteStorage(Storage):
+    """
+    Single-file storage for small deployments. Runs in WAL mode so readers do not
+    block the writer, and keeps user documents as JSON keyed by the binary
+    address key.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        """
+        :param path: database file, ":memory:" for a throwaway database
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False, cached_statements=64
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.ensure_indexes()
+
+    @staticmethod
+    def _user(row: tuple) -> dict:
+        return {"_id": ObjectId(row[0]), **json.loads(row[1])}
+
+    def database_names(self) -> list:
+        return ["main"]
+
+    def collection_names(self) -> list:
+        return ["users", "emails", "revoked_tokens"]
+
+    def ensure_indexes(self) -> None:
+        with self.lock:
+            self.connection.execute(CREATE_USERS)
+            self.connection.execute(CREATE_EMAILS)
+            self.connection.execute(CREATE_REVOKED_TOKENS)
+
+    def find_users(self) -> Iterator[dict]:
+        with self.lock:
+            rows = self.connection.execute(SELECT_USERS).fetchall()
+        return (self._user(row) for row in rows)
+
+    def find_user(self, key: bytes) -> Optional[dict]:
+        with self.lock:
+            row = self.connection.execute(SELECT_USER, (key,)).fetchone()
+        return self._user(row) if row else None
+
+    def find_user_revision(self, key: bytes) -> Optional[tuple]:
+        with self.lock:
+            row = self.connection.execute(SELECT_USER_REVISION, (key,)).fetchone()
+        return (ObjectId(row[0]), row[1] or 0) if row else None
+
+    def user_exists(self, key: bytes) -> bool:
+        with self.lock:
+            return (
+                self.connection.execute(SELECT_USER_EXISTS, (key,)).fetchone()
+                is not None
+            )
+
+    def insert_user(self, key: bytes, user_info: dict):
+        user_id = ObjectId()
+        doc = {**{k: v for k, v in user_info.items() if k != "_id"}, "version": 1}
+        try:
+            with self.lock:
+                self.connection.execute(
+                    INSERT_USER, (key, str(user_id), json.dumps(doc))
+                )
+            return user_id
+
+        except sqlite3.IntegrityError as e:
+            raise DuplicateUserError(str(e))
+
+    def update_user(
+        self, key: bytes, fields: dict, expected_version: int = None
+    ) -> Optional[int]:
+        with self.lock:
+            # IMMEDIATE takes the write lock up front so the read-modify-write is
+            # atomic against other processes sharing the file
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(SELECT_USER, (key,)).fetchone()
+                doc = json.loads(row[1]) if row else None
+                version = doc.get("version", 0) if doc else None
+                if doc is None or (
+                    expected_version is not None and version != expected_version
+                ):
+                    self.connection.execute("ROLLBACK")
+                    return None
+
+                doc = {**doc, **fields, "version": version + 1}
+                self.connection.execute(UPDATE_USER, (json.dumps(doc), key))
+                self.connection.execute("COMMIT")
+                return doc["version"]
+
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def delete_user(self, key: bytes) -> bool:
+        with self.lock:
+            return self.connection.execute(DELETE_USER, (key,)).rowcount == 1
+
+    def find_emails(self) -> Iterator[dict]:
+        with self.lock:
+            rows = self.connection.execute(SELECT_EMAILS).fetchall()
+        return ({"_id": ObjectId(row[0]), "email": row[1]} for row in rows)
+
+    def insert_email(self, email: str):
+        email_id = ObjectId()
+        with self.lock:
+            self.connection.execute(INSERT_EMAIL, (str(email_id), email))
+        return email_id
+
+    def insert_revoked_token(self, token_id: bytes, exp: int) -> None:
+        with self.lock:
+            self.connection.execute(INSERT_REVOKED_TOKEN, (token_id, exp))
+
+    def find_revoked_tokens(self, now: int) -> Iterator[bytes]:
+        with self.lock:
+            self.connection.execute(DELETE_EXPIRED_TOKENS, (now,))
+            rows = self.connection.execute(SELECT_REVOKED_TOKENS, (now,)).fetchall()
+        return (row[0] for row in rows)
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,92 @@
+"""
+Compares the legacy string index on publicAddress with the 20-byte binary
+addressKey index: index size and point-lookup latency.
+
+Needs a reachable MongoDB in MONGODB_PWD. A scratch collection is created in the
+given database and dropped afterwards.
+
+Usage:
+    python -m benchmarks.bench_address_key --db bench_db --users 100000
+"""
+import os
+import time
+import random
+import argparse
+import statistics
+
+from pymongo import MongoClient
+from dotenv import load_dotenv, find_dotenv
+from eth_utils import to_checksum_address
+
+from app.models.main import address_key
+
+
+def random_address() -> str:
+    return to_checksum_address("0x" + os.urandom(20).hex())
+
+
+def time_lookups(collection, queries: list) -> list:
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        collection.find_one(query, {"_id": 1})
+        timings.append((time.perf_counter() - start) * 1e6)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default="bench_db")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    args = parser.parse_args()
+
+    load_dotenv(find_dotenv())
+    client = MongoClient(os.environ.get("MONGODB_PWD"))
+    collection = client[args.db]["bench_address_key"]
+    collection.drop()
+
+    addresses = [random_address() for _ in range(args.users)]
+    for start in range(0, len(addresses), 10000):
+        collection.insert_many(
+            [
+                {"publicAddress": address, "addressKey": address_key(address)}
+                for address in addresses[start : start + 10000]
+            ]
+        )
+    collection.create_index("publicAddress")
+    collection.create_index("addressKey", unique=True)
+
+    sizes = client[args.db].command("collStats", "bench_address_key")["indexSizes"]
+    print(f"publicAddress_1 index: {sizes['publicAddress_1'] / 1024:.1f} KiB")
+    print(f"addressKey_1 index:    {sizes['addressKey_1'] / 1024:.1f} KiB")
+
+    # Clients send lowercase as often as checksum, which the string index misses
+    sample = [random.choice(addresses) for _ in range(args.lookups)]
+    mixed = [a.lower() if i % 2 else a for i, a in enumerate(sample)]
+
+    string_hits = sum(
+        collection.count_documents({"publicAddress": a}, limit=1) for a in mixed
+    )
+    binary_hits = sum(
+        collection.count_documents({"addressKey": address_key(a)}, limit=1)
+        for a in mixed
+    )
+    string_timings = time_lookups(collection, [{"publicAddress": a} for a in mixed])
+    binary_timings = time_lookups(
+        collection, [{"addressKey": address_key(a)} for a in mixed]
+    )
+
+    for name, timings in (("string", string_timings), ("binary", binary_timings)):
+        print(
+            f"{name} lookup: median {statistics.median(timings):.1f} us, "
+            f"p95 {statistics.quantiles(timings, n=20)[-1]:.1f} us"
+        )
+    print(f"string lookup hit rate with mixed casing: {string_hits / len(mixed):.0%}")
+    print(f"binary lookup hit rate with mixed casing: {binary_hits / len(mixed):.0%}")
+
+    collection.drop()
+
+
+if __name__ == "__main__":
+    main()
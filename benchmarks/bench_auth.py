@@ -0,0 +1,83 @@
+"""
+Measures what route-level auth costs per request: a single token verification
+against verifying once per check (as stacked decorators would), and the latency of
+an Admin route against the same route left public.
+
+Runs offline against the in-memory storage backend.
+
+Usage:
+    python -m benchmarks.bench_auth --requests 500
+"""
+import os
+import time
+import argparse
+import statistics
+
+os.environ.setdefault("STORAGE_URL", "memory://")
+
+from eth_account import Account  # noqa: E402
+from fastapi import Depends, FastAPI  # noqa: E402
+from starlette.testclient import TestClient  # noqa: E402
+
+from app.auth.main import Access, Authorizer  # noqa: E402
+from app.db_wrapper import DbWrapper, sign  # noqa: E402
+from app.storage.memory import MemoryStorage  # noqa: E402
+
+
+def per_call_us(operation, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        operation()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def make_app(db: DbWrapper, access: Access) -> FastAPI:
+    app = FastAPI(
+        dependencies=[Depends(Authorizer(db, policies={"/get_users": access}))]
+    )
+
+    @app.post("/get_users")
+    async def get_users():
+        return len(db.get_users())
+
+    return app
+
+
+def request_latencies_us(app: FastAPI, token: str, count: int) -> list:
+    latencies = []
+    with TestClient(app) as client:
+        for _ in range(count):
+            start = time.perf_counter()
+            client.post("/get_users", data={"token": token})
+            latencies.append((time.perf_counter() - start) * 1e6)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    db = DbWrapper(db_name="bench_db", storage=MemoryStorage())
+    account = Account.create()
+    db.admins.append(account.address.lower())
+    db.signature(account.address, sign(account, 0))
+    token = db.admin_signature(account.address, sign(account, 1, admin=True))["token"]
+
+    once = per_call_us(lambda: db.verify(token), args.requests)
+    stacked = per_call_us(
+        lambda: (db.verify(token), db.admin_verify(token)), args.requests
+    )
+    print(f"verify once:                  {once:10.1f} us")
+    print(f"verify + admin_verify:        {stacked:10.1f} us")
+
+    public = request_latencies_us(make_app(db, Access.PUBLIC), token, args.requests)
+    admin = request_latencies_us(make_app(db, Access.ADMIN), token, args.requests)
+    overhead = statistics.median(admin) - statistics.median(public)
+    print(f"public route median latency:  {statistics.median(public):10.1f} us")
+    print(f"admin route median latency:   {statistics.median(admin):10.1f} us")
+    print(f"auth overhead per request:    {overhead:10.1f} us")
+
+
+if __name__ == "__main__":
+    main()
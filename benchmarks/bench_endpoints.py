@@ -0,0 +1,461 @@
+"""
+Drives every route of app.main through the full ASGI stack (auth, form parsing,
+profiling middleware, serialization) with generated wallets and real EIP-191
+signatures, and reports throughput and p50/p95/p99 latency per route and
+concurrency level. Results are compared with a stored baseline; the run exits
+with status 1 when a route gets slower than the threshold allows, starts failing
+requests, or when there is no baseline. Slowdowns are judged on wall-clock p95
+and throughput relative to a signature recovery timed around each round, so the
+machine's speed drifting between runs does not fail the gate, and on the best of
+several rounds spread over the run, so neither does a spell of other load.
+
+Everything runs in one process against a local stand-in for MongoDB (mongomock,
+or the memory / SQLite backends), so numbers measure the API itself. Requests of
+one level are spread over that many concurrent clients on one event loop, which
+shows how latency grows with queueing on a single worker. Wallets are created
+and every signature is made before timing starts. Record the baseline on the
+machine that runs the comparison, timings do not carry over between machines.
+
+Usage:
+    python -m benchmarks.bench_endpoints --update-baseline
+    python -m benchmarks.bench_endpoints [--requests 200] [--rounds 5]
+        [--concurrency 1,4,16]
+        [--storage mongomock|memory|sqlite] [--threshold 0.25]
+        [--baseline benchmarks/baseline.json]
+"""
+import gc
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+import httpx
+from eth_account import Account
+from eth_account.messages import encode_defunct
+from eth_utils import to_checksum_address
+
+from app.db_wrapper import sign
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+FAILED = (b"false", b"null", b"{}")
+# Fewer requests per level give p95s that move by more than the threshold
+# between two runs of the same code on the same machine
+MIN_GATE_REQUESTS = 200
+CALIBRATION = encode_defunct(text="calibration")
+# The p95 of a route answering in a few milliseconds moves by more than the
+# threshold between runs, so p95 regressions must also exceed this many recoveries
+MIN_P95_CHANGE = 0.5
+
+
+def load_app(storage: str):
+    """
+    :param storage: one of "mongomock", "memory" or "sqlite"
+    :return: the app and its DbWrapper, running on a fresh local backend
+    """
+    # app.main builds its DbWrapper at import, never let it reach a real database
+    os.environ["STORAGE_URL"] = "sqlite://" if storage == "sqlite" else "memory://"
+    os.environ["STORAGE_SHARDS"] = ""
+
+    from app.main import app, db
+
+    if storage == "mongomock":
+        import mongomock
+
+        from app.storage.mongo import MongoStorage
+
+        db.storage = MongoStorage(client=mongomock.MongoClient(), db_name="bench_db")
+        db.ensure_indexes()
+        db.rebuild_revocations()
+    return app, db
+
+
+class Fixtures:
+    """
+    Wallets registered through DbWrapper before timing: an Admin, a pool of users
+    with profiles and emails, and fresh wallets on demand.
+    """
+
+    def __init__(self, db, users: int):
+        """
+        :param db: DbWrapper of the app under test
+        :param users: number of registered users to seed
+        """
+        self.db = db
+        self.admin, self.admin_token = self.register(admin=True)
+        self.calibration_signature = self.admin.sign_message(CALIBRATION).signature
+
+        self.users = [self.register() for _ in range(users)]
+        for i, (account, _) in enumerate(self.users):
+            db.update_user(
+                {
+                    "publicAddress": account.address,
+                    "name": f"User {i}",
+                    "bio": "Collector",
+                    "points": i,
+                }
+            )
+            db.set_email(f"user{i}@example.com")
+
+    def register(self, admin: bool = False) -> tuple:
+        """
+        :param admin: whether to list the wallet in ADMINS and return an Admin token
+        :return: a new account and its token, the next nonce to sign is 1 for a
+        user and 2 for an Admin
+        """
+        account = Account.create()
+        token = self.db.signature(account.address, sign(account, 0))["token"]
+        if admin:
+            self.db.admins.append(account.address.lower())
+            signature = sign(account, 1, admin=True)
+            token = self.db.admin_signature(account.address, signature)["token"]
+        return account, token
+
+    def user(self) -> tuple:
+        return random.choice(self.users)
+
+
+# Each scenario builds the form data for one client's requests. Requests of one
+# client run in order, so a client can own a wallet whose nonce it advances.
+def user_signature(fx: Fixtures, count: int) -> list:
+    account, _ = fx.register()
+    return [
+        {"publicAddress": account.address, "signature": sign(account, nonce)}
+        for nonce in range(1, count + 1)
+    ]
+
+
+def update_user(fx: Fixtures, count: int) -> list:
+    account, token = fx.register()
+    return [
+        {"publicAddress": account.address, "token": token, "bio": f"Collector #{i}"}
+        for i in range(count)
+    ]
+
+
+def get_user(fx: Fixtures, count: int) -> list:
+    return [
+        {"public_address": account.address, "token": token}
+        for account, token in (fx.user() for _ in range(count))
+    ]
+
+
+def user_verify(fx: Fixtures, count: int) -> list:
+    return [
+        {"publicAddress": account.address, "token": token}
+        for account, token in (fx.user() for _ in range(count))
+    ]
+
+
+def user_logout(fx: Fixtures, count: int) -> list:
+    return [{"token": fx.register()[1]} for _ in range(count)]
+
+
+def set_email(fx: Fixtures, count: int) -> list:
+    account, token = fx.register()
+    return [
+        {"publicAddress": account.address, "token": token, "email": f"{i}@bench.io"}
+        for i in range(count)
+    ]
+
+
+def set_user(fx: Fixtures, count: int) -> list:
+    return [
+        {
+            "publicAddress": to_checksum_address(os.urandom(20)),
+            "token": fx.admin_token,
+            "name": "Bench",
+        }
+        for _ in range(count)
+    ]
+
+
+def user_exists(fx: Fixtures, count: int) -> list:
+    return [
+        {"public_address": fx.user()[0].address, "token": fx.admin_token}
+        for _ in range(count)
+    ]
+
+
+def admin_signature(fx: Fixtures, count: int) -> list:
+    account, _ = fx.register(admin=True)
+    return [
+        {"publicAddress": account.address, "signature": sign(account, nonce, True)}
+        for nonce in range(2, count + 2)
+    ]
+
+
+def admin_verify(fx: Fixtures, count: int) -> list:
+    data = {"publicAddress": fx.admin.address, "token": fx.admin_token}
+    return [data] * count
+
+
+def admin_only(fx: Fixtures, count: int) -> list:
+    return [{"token": fx.admin_token}] * count
+
+
+SCENARIOS = {
+    "/": ("GET", lambda fx, count: [None] * count),
+    "/user_exists": ("POST", user_exists),
+    "/get_users": ("POST", admin_only),
+    "/set_user": ("POST", set_user),
+    "/update_user": ("POST", update_user),
+    "/get_user": ("POST", get_user),
+    "/user/signature": ("POST", user_signature),
+    "/user/verify": ("POST", user_verify),
+    "/user/logout": ("POST", user_logout),
+    "/admin/signature": ("POST", admin_signature),
+    "/admin/verify": ("POST", admin_verify),
+    "/get_emails": ("POST", admin_only),
+    "/set_email": ("POST", set_email),
+    "/admin/slow_requests": ("POST", admin_only),
+}
+
+
+def calibrate(signature: bytes, repeat: int = 10) -> float:
+    """
+    :param signature: signature of CALIBRATION
+    :param repeat: number of recoveries to time
+    :return: milliseconds per signature recovery, which is most of what an
+    authenticated request spends its CPU on
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        Account.recover_message(CALIBRATION, signature=signature)
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def percentile(latencies: list, p: int) -> float:
+    return statistics.quantiles(latencies, n=100, method="inclusive")[p - 1]
+
+
+async def run_level(app, method: str, path: str, clients: list) -> dict:
+    """
+    :param app: ASGI app under test
+    :param method: HTTP method of the route
+    :param path: path of the route
+    :param clients: form data of every request, one list per concurrent client
+    :return: throughput, latency percentiles in milliseconds and failed requests
+    """
+    latencies, errors = [], 0
+
+    async def client_loop(client: httpx.AsyncClient, requests: list):
+        nonlocal errors
+        for data in requests:
+            start = time.perf_counter()
+            response = await client.request(method, path, data=data)
+            latencies.append((time.perf_counter() - start) * 1000)
+            # Endpoints answer failures with 200 and false, or {} for an exception
+            if response.status_code != 200 or response.content in FAILED:
+                errors += 1
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        # Collector pauses land on random requests and dominate p95 of short runs
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            await asyncio.gather(*(client_loop(client, r) for r in clients))
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "errors": errors,
+    }
+
+
+def run_round(app, method: str, path: str, scenario, fx, level: int, args) -> dict:
+    """
+    :return: statistics of one timed round of args.requests spread over level
+    concurrent clients, and the speed of the machine around it from calibrate
+    """
+    per_client = max(args.requests // level, 1)
+    clients = [scenario(fx, per_client) for _ in range(level)]
+    before = calibrate(fx.calibration_signature)
+    stats = asyncio.run(run_level(app, method, path, clients))
+    stats["calibration"] = (before + calibrate(fx.calibration_signature)) / 2
+    return stats
+
+
+def summarize(rounds: list) -> dict:
+    """
+    :param rounds: statistics of every round of one route and concurrency level
+    :return: the median of every statistic over the rounds, failed requests summed,
+    and for compare the lowest p95 and highest throughput of any round, both
+    relative to the time of one signature recovery in that round
+    """
+    stats = {
+        name: statistics.median(r[name] for r in rounds)
+        for name in ("rps", "p50", "p95", "p99", "calibration")
+    }
+    stats["relative_p95"] = min(r["p95"] / r["calibration"] for r in rounds)
+    stats["relative_rps"] = max(r["rps"] * r["calibration"] for r in rounds)
+    stats["errors"] = sum(r["errors"] for r in rounds)
+    return stats
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Compares wall-clock p95 and throughput of the best round, measured against
+    a signature recovery timed right around the round. That cancels out the
+    machine getting slower or faster between runs but not time the code spends
+    waiting. The rounds of one level are minutes apart, so the best one is
+    unlikely to have been disturbed by a spell of load from other processes.
+
+    :param results: results of this run, route -> concurrency -> stats
+    :param baseline: results of the baseline run in the same layout, with every
+    route and concurrency level of results
+    :param threshold: allowed relative slowdown, 0.25 allows 25% worse
+    :return: a description of every regression
+    """
+    regressions = []
+    for path, levels in results.items():
+        for level, stats in levels.items():
+            base = baseline[path][level]
+            name = f"{path} @ {level}"
+            if stats["errors"] > base["errors"]:
+                regressions.append(f"{name}: {stats['errors']} failed requests")
+            # Shown in milliseconds at the speed of the baseline run
+            scale = base["calibration"]
+            if stats["relative_p95"] > max(
+                base["relative_p95"] * (1 + threshold),
+                base["relative_p95"] + MIN_P95_CHANGE,
+            ):
+                regressions.append(
+                    f"{name}: p95 {stats['relative_p95'] * scale:.2f} ms "
+                    f"vs {base['relative_p95'] * scale:.2f} ms"
+                )
+            if stats["relative_rps"] < base["relative_rps"] * (1 - threshold):
+                regressions.append(
+                    f"{name}: {stats['relative_rps'] / scale:.0f} req/s "
+                    f"vs {base['relative_rps'] / scale:.0f} req/s"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="per level")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument(
+        "--rounds", type=int, default=5, help="timed rounds per level, best compared"
+    )
+    parser.add_argument("--users", type=int, default=200, help="seeded users")
+    parser.add_argument(
+        "--storage", choices=["mongomock", "memory", "sqlite"], default="mongomock"
+    )
+    parser.add_argument("--routes", help="comma separated subset of routes to run")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.requests < MIN_GATE_REQUESTS:
+        parser.error(
+            f"--requests must be at least {MIN_GATE_REQUESTS} for a stable comparison"
+        )
+    if args.storage == "mongomock":
+        try:
+            import mongomock  # noqa: F401
+        except ImportError:
+            parser.error("pip install mongomock, or pick another --storage")
+
+    random.seed(args.seed)
+    levels = [int(level) for level in args.concurrency.split(",")]
+    app, db = load_app(args.storage)
+
+    paths = {route.path for route in app.routes if route.include_in_schema}
+    missing = paths - set(SCENARIOS)
+    if missing:
+        parser.error(f"No scenario for: {', '.join(sorted(missing))}")
+    routes = args.routes.split(",") if args.routes else list(SCENARIOS)
+
+    print(f"Seeding {args.users} users on {args.storage}...")
+    fx = Fixtures(db, args.users)
+
+    # Two untimed requests per client warm up every route and level
+    for path in routes:
+        method, scenario = SCENARIOS[path]
+        for level in levels:
+            clients = [scenario(fx, 2) for _ in range(level)]
+            asyncio.run(run_level(app, method, path, clients))
+
+    # One pass over every route and level per round, rather than all rounds of a
+    # level in a row, so a slow spell of the machine hits one round of each
+    rounds = {}
+    for i in range(args.rounds):
+        print(f"Round {i + 1}/{args.rounds}...")
+        for path in routes:
+            method, scenario = SCENARIOS[path]
+            for level in levels:
+                stats = run_round(app, method, path, scenario, fx, level, args)
+                rounds.setdefault((path, level), []).append(stats)
+
+    results = {}
+    print(
+        f"{'route':<22}{'clients':>8}{'req/s':>10}{'p50 ms':>10}"
+        f"{'p95 ms':>10}{'p99 ms':>10}{'calib ms':>10}{'errors':>8}"
+    )
+    for path in routes:
+        for level in levels:
+            stats = summarize(rounds[path, level])
+            results.setdefault(path, {})[str(level)] = stats
+            print(
+                f"{path:<22}{level:>8}{stats['rps']:>10,.0f}{stats['p50']:>10.2f}"
+                f"{stats['p95']:>10.2f}{stats['p99']:>10.2f}"
+                f"{stats['calibration']:>10.2f}{stats['errors']:>8}"
+            )
+
+    run = {
+        "storage": args.storage,
+        "requests": args.requests,
+        "rounds": args.rounds,
+        "results": results,
+    }
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(run, f, indent=2, sort_keys=True)
+        print(f"\nBaseline written to {args.baseline}")
+        return
+
+    # Nothing compared must not pass the gate
+    if not os.path.exists(args.baseline):
+        sys.exit(f"No baseline at {args.baseline}, run with --update-baseline first")
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    for option in ("storage", "requests", "rounds"):
+        if baseline.get(option) != run[option]:
+            sys.exit(
+                f"Baseline was recorded with --{option} {baseline.get(option)}, "
+                f"this run used {run[option]}"
+            )
+    missing = [
+        f"{path} @ {level}"
+        for path, levels in results.items()
+        for level in levels
+        if level not in baseline["results"].get(path, {})
+    ]
+    if missing:
+        sys.exit(f"Baseline has no results for: {', '.join(missing)}")
+
+    regressions = compare(results, baseline["results"], args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regressions beyond {args.threshold:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print(f"\nNo regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
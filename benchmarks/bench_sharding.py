@@ -0,0 +1,61 @@
+"""
+Checks how evenly the consistent hash ring spreads users over N shards, how many
+of them a rebalance moves when one shard is added (ideally 1/(N+1)), and what the
+routing and streaming merge cost compared to a single backend. Uses in-memory
+shards, so it runs offline.
+
+Usage:
+    python -m benchmarks.bench_sharding --users 20000 --shards 4
+"""
+import os
+import argparse
+
+from benchmarks.bench_storage import run
+from app.storage.memory import MemoryStorage
+from app.storage.sharded import ShardedStorage, rebalance
+
+
+def sharded(names: list, replicas: int) -> ShardedStorage:
+    return ShardedStorage(
+        {name: MemoryStorage(db_name=name) for name in names}, replicas=replicas
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--replicas", type=int, default=128)
+    args = parser.parse_args()
+
+    names = [f"shard{i}" for i in range(args.shards)]
+    storage = sharded(names, args.replicas)
+    for _ in range(args.users):
+        key = os.urandom(20)
+        storage.insert_user(key, {"publicAddress": "0x" + key.hex(), "nonce": 0})
+
+    mean = args.users / args.shards
+    print(f"{'shard':<10}{'users':>10}{'of mean':>10}")
+    for name, shard in storage.shards.items():
+        count = len(shard.user_index)
+        print(f"{name:<10}{count:>10}{count / mean:>10.2f}")
+
+    grown = ShardedStorage(
+        {**storage.shards, f"shard{args.shards}": MemoryStorage()},
+        replicas=args.replicas,
+    )
+    moved = rebalance(grown, dry_run=True)["moved"]
+    print(
+        f"\nAdding a shard moves {moved / args.users:.1%} of users "
+        f"(ideal {1 / (args.shards + 1):.1%})\n"
+    )
+
+    print(f"{'backend':<10}{'operation':>14}{'ops/s':>14}")
+    backends = {"single": MemoryStorage(), "sharded": sharded(names, args.replicas)}
+    for name, backend in backends.items():
+        for operation, rate in run(backend, args.users).items():
+            print(f"{name:<10}{operation:>14}{rate:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Runs the same insert / lookup / update / scan workload against every storage
+backend and prints operations per second. Memory and SQLite run offline; pass
+--mongo-url to include a MongoDB deployment.
+
+Usage:
+    python -m benchmarks.bench_storage --users 20000 [--mongo-url mongodb://localhost]
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+
+from app.storage.memory import MemoryStorage
+from app.storage.mongo import MongoStorage
+from app.storage.sqlite import SqliteStorage
+
+
+def timed(operation, items) -> float:
+    """
+    :param operation: callable run once per item
+    :param items: arguments for operation
+    :return: operations per second
+    """
+    start = time.perf_counter()
+    for item in items:
+        operation(item)
+    return len(items) / (time.perf_counter() - start)
+
+
+def run(storage, users: int) -> dict:
+    keys = [os.urandom(20) for _ in range(users)]
+    lookups = [random.choice(keys) for _ in range(users)]
+    storage.ensure_indexes()
+
+    result = {
+        "insert": timed(
+            lambda key: storage.insert_user(
+                key, {"publicAddress": "0x" + key.hex(), "nonce": 0}
+            ),
+            keys,
+        ),
+        "find_user": timed(storage.find_user, lookups),
+        "user_exists": timed(storage.user_exists, lookups),
+        "update_user": timed(lambda key: storage.update_user(key, {"nonce": 1}), keys),
+    }
+    start = time.perf_counter()
+    scanned = sum(1 for _ in storage.find_users())
+    result["find_users"] = scanned / (time.perf_counter() - start)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--mongo-url", default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        backends = {
+            "memory": MemoryStorage(),
+            "sqlite": SqliteStorage(path=os.path.join(directory, "bench.db")),
+        }
+        if args.mongo_url:
+            backends["mongo"] = MongoStorage(url=args.mongo_url, db_name="bench_db")
+            backends["mongo"].database.drop_collection("users")
+
+        print(f"{'backend':<8}{'operation':>14}{'ops/s':>14}")
+        for name, storage in backends.items():
+            for operation, rate in run(storage, args.users).items():
+                print(f"{name:<8}{operation:>14}{rate:>14,.0f}")
+
+            if name == "mongo":
+                storage.database.drop_collection("users")
+            storage.close()
+
+
+if __name__ == "__main__":
+    main()
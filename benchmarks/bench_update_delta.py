@@ -0,0 +1,108 @@
+"""
+Reports the write volume of profile updates before and after delta updates: the
+old behaviour $set every User field on each call, now only changed fields are
+written and no-op updates are skipped.
+
+The workload sends one or two profile fields per update, and a share of updates
+resubmit values the user already has. Runs offline against the in-memory
+storage backend.
+
+Usage:
+    python -m benchmarks.bench_update_delta --users 200 --updates 5000 --noop 0.3
+"""
+import os
+import random
+import argparse
+
+import bson
+from eth_utils import to_checksum_address
+
+from app.db_wrapper import DbWrapper
+from app.models.main import User, address_key
+from app.storage.memory import MemoryStorage
+
+PROFILE_FIELDS = ["name", "email", "instagram", "twitter", "bio", "profileImage"]
+
+
+class CountingStorage(MemoryStorage):
+    """
+    MemoryStorage recording how many updates reach it and how large they are.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+        self.fields_written = 0
+        self.bytes_written = 0
+
+    def update_user(self, key: bytes, fields: dict, expected_version: int = None):
+        self.writes += 1
+        self.fields_written += len(fields)
+        self.bytes_written += len(bson.encode(fields))
+        return super().update_user(key, fields, expected_version)
+
+
+def workload(addresses: list, updates: int, noop: float) -> list:
+    """
+    :return: (public address, fields sent by the client) per update
+    """
+    profiles = {address: {} for address in addresses}
+    requests = []
+    for _ in range(updates):
+        address = random.choice(addresses)
+        profile = profiles[address]
+        if profile and random.random() < noop:
+            sent = dict(random.sample(sorted(profile.items()), 1))
+        else:
+            sent = {
+                field: f"{field}-{random.randrange(10 ** 6)}"
+                for field in random.sample(PROFILE_FIELDS, random.randint(1, 2))
+            }
+            profile.update(sent)
+        requests.append((address, sent))
+    return requests
+
+
+def run(requests: list, addresses: list, delta: bool) -> CountingStorage:
+    storage = CountingStorage()
+    db = DbWrapper(db_name="bench_db", storage=storage)
+    for address in addresses:
+        db.set_user({"publicAddress": address, "nonce": 0})
+
+    for address, sent in requests:
+        user = User(publicAddress=address, token="jwt", **sent)
+        if delta:
+            changes = user.dict(exclude_unset=True, exclude={"token"})
+            db.update_user(changes)
+        else:  # What /update_user used to do
+            storage.update_user(address_key(address), dict(user))
+
+    return storage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--noop", type=float, default=0.3, help="share of no-ops")
+    args = parser.parse_args()
+
+    addresses = [to_checksum_address(os.urandom(20)) for _ in range(args.users)]
+    requests = workload(addresses, args.updates, args.noop)
+
+    before = run(requests, addresses, delta=False)
+    after = run(requests, addresses, delta=True)
+
+    print(f"{'':<16}{'writes':>10}{'fields':>10}{'bytes':>12}")
+    for name, storage in (("full document", before), ("delta", after)):
+        print(
+            f"{name:<16}{storage.writes:>10,}{storage.fields_written:>10,}"
+            f"{storage.bytes_written:>12,}"
+        )
+    print(
+        f"bytes written reduced by {1 - after.bytes_written / before.bytes_written:.0%}"
+    )
+
+
+if __name__ == "__main__":
+    main()
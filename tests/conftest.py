@@ -0,0 +1,36 @@
+import os
+
+import pytest
+from eth_account import Account
+
+# Run the app against the in-memory backend so the suite needs no live MongoDB.
+# Must happen before app.main is imported, which builds its DbWrapper at import.
+os.environ["STORAGE_URL"] = "memory://"
+
+from app.db_wrapper import sign  # noqa: E402
+
+
+@pytest.fixture
+def user():
+    """
+    :return: a registered wallet and its token
+    """
+    from app.main import db
+
+    account = Account.create()
+    token = db.signature(account.address, sign(account, 0))["token"]
+    return account, token
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    """
+    :return: a registered wallet listed in ADMINS and its Admin token
+    """
+    from app.main import db
+
+    account = Account.create()
+    monkeypatch.setattr(db, "admins", db.admins + [account.address.lower()])
+    db.signature(account.address, sign(account, 0))
+    token = db.admin_signature(account.address, sign(account, 1, admin=True))["token"]
+    return account, token
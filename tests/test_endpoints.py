@@ -1,7 +1,6 @@
 from starlette.testclient import TestClient
-from app.main import app
-
-from app.models.main import Admin, User
+from app.main import app, db, profiler
+from app.models.main import address_key
 
 
 class TestEndpoints:
@@ -11,14 +10,169 @@ class TestEndpoints:
             assert response.status_code == 200
             assert response.json() == "Welcome to the API"
 
-    def test_set_user(self):
+    def test_set_user(self, admin):
+        address = "0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAed"
         with TestClient(app) as client:
-            test_data = User(publicAddress="0x777888999", firstName="John")
-
             response = client.post(
                 "/set_user",
-                json=test_data.json()
+                data={"publicAddress": address.lower(), "name": "John"},
+                headers={"Authorization": f"Bearer {admin[1]}"},
+            )
+            assert response.status_code == 200
+            assert "success" in response.json()
+
+        user = db.get_user_by_public_address(address)
+        assert (user["publicAddress"], user["name"]) == (address, "John")
+        db.delete_user(address)
+
+    def test_set_user_does_not_store_token(self, admin):
+        address = "0xfB6916095ca1df60bB79Ce92cE3Ea74c37c5d359"
+        with TestClient(app) as client:
+            client.post("/set_user", data={"publicAddress": address, "token": admin[1]})
+
+        user = db.get_user_by_public_address(address)
+        assert admin[1] not in user.values()
+        assert "token" not in user
+        db.delete_user(address)
+
+    def test_admin_route_requires_token(self):
+        with TestClient(app) as client:
+            response = client.post("/get_users")
+            assert response.status_code == 401
+
+    def test_admin_route_rejects_registered_user(self, user):
+        with TestClient(app) as client:
+            response = client.post("/get_users", data={"token": user[1]})
+            assert response.status_code == 403
+
+    def test_admin_route_accepts_admin(self, admin):
+        with TestClient(app) as client:
+            response = client.post("/get_users", data={"token": admin[1]})
+            assert response.status_code == 200
+            assert admin[0].address in [u["publicAddress"] for u in response.json()]
+
+    def test_profiled_request_verifies_token_once(self, admin, monkeypatch, tmp_path):
+        calls = []
+        verify = db.verify
+        monkeypatch.setattr(
+            db, "verify", lambda token: calls.append(token) or verify(token)
+        )
+        monkeypatch.setattr(profiler, "directory", str(tmp_path))
+        with TestClient(app) as client:
+            response = client.post(
+                "/get_users",
+                headers={"Authorization": f"Bearer {admin[1]}", "X-Profile": admin[1]},
+            )
+            assert response.status_code == 200
+
+        assert calls == [admin[1]]
+        assert len(list(tmp_path.iterdir())) == 1
+
+    def test_registered_user_can_only_update_own_profile(self, user, admin):
+        with TestClient(app) as client:
+            own = client.post(
+                "/update_user",
+                data={"publicAddress": user[0].address, "token": user[1], "bio": "hi"},
+            )
+            other = client.post(
+                "/update_user",
+                data={"publicAddress": admin[0].address, "token": user[1], "bio": "x"},
             )
-            print(response.json())
+            assert own.status_code == 200 and own.json() is True
+            assert other.status_code == 403
+
+    def test_logout_revokes_token(self, user):
+        with TestClient(app) as client:
+            response = client.post("/user/logout", data={"token": user[1]})
+            assert response.json() is True
+
+            response = client.post("/user/logout", data={"token": user[1]})
+            assert response.status_code == 401
+
+    def test_get_user_not_modified(self, user):
+        with TestClient(app) as client:
+            data = {"public_address": user[0].address, "token": user[1]}
+            response = client.post("/get_user", data=data)
             assert response.status_code == 200
+            tag = response.headers["ETag"]
+
+            response = client.post(
+                "/get_user", data=data, headers={"If-None-Match": tag}
+            )
+            assert response.status_code == 304
+            assert response.headers["ETag"] == tag
+
+            client.post(
+                "/update_user",
+                data={"publicAddress": user[0].address, "token": user[1], "bio": "new"},
+            )
+            response = client.post(
+                "/get_user", data=data, headers={"If-None-Match": tag}
+            )
+            assert response.status_code == 200
+            assert response.headers["ETag"] != tag
+
+    def test_get_user_sees_writes_from_other_processes(self, user):
+        with TestClient(app) as client:
+            data = {"public_address": user[0].address, "token": user[1]}
+            tag = client.post("/get_user", data=data).headers["ETag"]
+
+            # Stands in for another worker or the migration tool
+            db.storage.update_user(address_key(user[0].address), {"bio": "elsewhere"})
+            response = client.post(
+                "/get_user", data=data, headers={"If-None-Match": tag}
+            )
+            assert response.status_code == 200
+            assert response.json()["bio"] == "elsewhere"
+            assert response.headers["ETag"] != tag
+
+    def test_update_user_if_match(self, user):
+        with TestClient(app) as client:
+            response = client.post(
+                "/get_user", data={"public_address": user[0].address, "token": user[1]}
+            )
+            tag = response.headers["ETag"]
+            data = {"publicAddress": user[0].address, "token": user[1], "bio": "new"}
+
+            response = client.post("/update_user", data=data, headers={"If-Match": tag})
+            assert response.status_code == 200
+            assert response.headers["ETag"] != tag
+
+            response = client.post("/update_user", data=data, headers={"If-Match": tag})
+            assert response.status_code == 412
+
+    def test_update_user_only_writes_sent_fields(self, user):
+        with TestClient(app) as client:
+            auth = {"publicAddress": user[0].address, "token": user[1]}
+            client.post("/update_user", data={**auth, "bio": "hi"})
+            client.post("/update_user", data={**auth, "name": "Alice"})
+
+            response = client.post(
+                "/get_user", data={"public_address": user[0].address, "token": user[1]}
+            )
+            profile = response.json()
+            assert (profile["bio"], profile["name"]) == ("hi", "Alice")
+            assert "token" not in profile and "twitter" not in profile
+
+    def test_update_user_clears_field_sent_empty(self, user):
+        with TestClient(app) as client:
+            auth = {"publicAddress": user[0].address, "token": user[1]}
+            client.post("/update_user", data={**auth, "bio": "hello", "points": 5})
+
+            response = client.post(
+                "/update_user", data={**auth, "bio": "", "points": ""}
+            )
+            assert response.json() is True
+
+        profile = db.get_user_by_public_address(user[0].address)
+        assert (profile["bio"], profile["points"]) == ("", 0)
+
+    def test_update_user_skips_noop_writes(self, user):
+        with TestClient(app) as client:
+            data = {"publicAddress": user[0].address, "token": user[1], "bio": "hi"}
+            client.post("/update_user", data=data)
+            writes = db.write_stats["writes"]
 
+            response = client.post("/update_user", data=data)
+            assert response.json() is True
+            assert db.write_stats["writes"] == writes
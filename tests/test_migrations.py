@@ -0,0 +1,93 @@
+import pytest
+from pymongo.errors import BulkWriteError
+
+from app.db_wrapper import DbWrapper
+from app.migrations.main import migrate_addresses
+from app.models.main import address_key
+from app.storage.mongo import MongoStorage
+
+mongomock = pytest.importorskip("mongomock")
+
+ALICE = "0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAed"
+BOB = "0xfB6916095ca1df60bB79Ce92cE3Ea74c37c5d359"
+CAROL = "0xdbF03B407c01E7cD3CBea99509d93f8DDDC8C6FB"
+
+
+@pytest.fixture
+def db():
+    storage = MongoStorage(client=mongomock.MongoClient(), db_name="test_db")
+    return DbWrapper(db_name="test_db", storage=storage)
+
+
+class TestMigrateAddresses:
+    def test_converts_legacy_users(self, db):
+        users = db.storage.collection("users")
+        users.insert_many(
+            [
+                {"publicAddress": BOB.lower(), "nonce": 1},
+                {"publicAddress": "0x123", "nonce": 1},
+            ]
+        )
+
+        result = migrate_addresses(db, batch_size=1)
+
+        assert result == {"migrated": 1, "skipped": 1, "duplicates": 0, "failed": 0}
+        assert db.get_user_by_public_address(BOB)["publicAddress"] == BOB
+
+    def test_merges_addresses_differing_by_case(self, db):
+        users = db.storage.collection("users")
+        users.insert_many(
+            [
+                {"publicAddress": ALICE.lower(), "nonce": 3, "name": "old"},
+                {"publicAddress": ALICE, "nonce": 5, "name": "new"},
+                {"publicAddress": ALICE.upper().replace("0X", "0x"), "nonce": 5},
+            ]
+        )
+
+        result = migrate_addresses(db)
+
+        assert (result["migrated"], result["duplicates"]) == (1, 2)
+        assert users.count_documents({}) == 1
+        user = db.get_user_by_public_address(ALICE)
+        assert (user["nonce"], user["name"]) == (5, "new")
+
+        duplicates = list(db.storage.collection("users_duplicates").find())
+        assert sorted(d["nonce"] for d in duplicates) == [3, 5]
+        assert all(d["duplicateOf"] == user["_id"] for d in duplicates)
+
+    def test_merges_with_already_migrated_user(self, db):
+        db.set_user({"publicAddress": CAROL, "nonce": 2})
+        db.set_user({"publicAddress": BOB, "nonce": 2})
+        users = db.storage.collection("users")
+        users.insert_many(
+            [
+                {"publicAddress": CAROL.lower(), "nonce": 1},  # Loses on nonce
+                {"publicAddress": BOB.lower(), "nonce": 7},  # Wins on nonce
+            ]
+        )
+
+        result = migrate_addresses(db)
+
+        assert (result["migrated"], result["duplicates"]) == (1, 2)
+        assert users.count_documents({"addressKey": address_key(CAROL)}) == 1
+        assert users.count_documents({"addressKey": address_key(BOB)}) == 1
+        assert db.get_user_by_public_address(CAROL)["nonce"] == 2
+        assert db.get_user_by_public_address(BOB)["nonce"] == 7
+
+    def test_reports_failed_writes(self, db, monkeypatch):
+        db.storage.collection("users").insert_many(
+            [{"publicAddress": ALICE.lower()}, {"publicAddress": BOB.lower()}]
+        )
+
+        def bulk_write(self, requests, ordered=True):
+            raise BulkWriteError(
+                {
+                    "nModified": 1,
+                    "writeErrors": [{"index": 1, "code": 11000, "errmsg": "dup"}],
+                }
+            )
+
+        monkeypatch.setattr(mongomock.Collection, "bulk_write", bulk_write)
+        result = migrate_addresses(db)
+
+        assert (result["migrated"], result["failed"]) == (1, 1)
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+from fastapi.exceptions import RequestValidationError
+
+from app.models.main import Admin, User, address_key, normalize_address
+
+ALICE = "0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAed"
+
+
+class TestAddresses:
+    def test_normalize_address(self):
+        assert normalize_address(ALICE.lower()) == ALICE
+        assert normalize_address(ALICE.upper().replace("0X", "0x")) == ALICE
+        assert normalize_address("") == ""
+        assert normalize_address(None) is None
+
+    def test_normalize_address_rejects_invalid(self):
+        for address in ("0x123", "hello", "0x" + "g" * 40):
+            with pytest.raises(ValueError):
+                normalize_address(address)
+
+    def test_address_key(self):
+        key = address_key(ALICE)
+
+        assert key == bytes.fromhex(ALICE[2:])
+        assert len(key) == 20
+        assert address_key(ALICE.lower()) == key
+
+    def test_address_key_rejects_invalid(self):
+        with pytest.raises(ValueError):
+            address_key("0x123")
+
+
+class TestModels:
+    def test_validators_normalize(self):
+        assert User(publicAddress=ALICE.lower()).publicAddress == ALICE
+        assert Admin(publicAddress=ALICE.lower()).publicAddress == ALICE
+        assert User().publicAddress == ""
+
+    def test_validators_reject_invalid(self):
+        with pytest.raises(ValueError):
+            User(publicAddress="0x777888999")
+        with pytest.raises(ValueError):
+            Admin(publicAddress="0x777888999")
+
+    def test_as_form_raises_request_validation_error(self):
+        with pytest.raises(RequestValidationError):
+            asyncio.run(User.as_form(publicAddress="0x777888999"))
@@ -0,0 +1,132 @@
+import os
+import time
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+from starlette.testclient import TestClient
+
+from app.decorators.main import traced
+from app.profiling import RequestProfiler, TracedRoute
+
+
+class FakeDb:
+    @traced
+    def get_users(self) -> list:
+        return []
+
+
+def make_app(profiler: RequestProfiler) -> FastAPI:
+    app = FastAPI()
+    app.router.route_class = TracedRoute
+    app.middleware("http")(profiler)
+    db = FakeDb()
+
+    @app.post("/get_users")
+    async def get_users():
+        return db.get_users()
+
+    return app
+
+
+def spin(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+# Longer than the 5 ms GIL switch interval, so the profiler thread also gets to
+# sample while the loop runs a request and not only while it waits for I/O
+def spin_profiled() -> None:
+    spin(0.02)
+
+
+def spin_other() -> None:
+    spin(0.02)
+
+
+def make_concurrent_app(profiler: RequestProfiler) -> FastAPI:
+    app = FastAPI()
+    app.router.route_class = TracedRoute
+    app.middleware("http")(profiler)
+
+    @app.post("/profiled")
+    async def profiled():
+        for _ in range(5):
+            spin_profiled()
+            await asyncio.sleep(0)
+
+    @app.post("/other")
+    async def other():
+        for _ in range(5):
+            spin_other()
+            await asyncio.sleep(0)
+
+    return app
+
+
+class TestProfiling:
+    def test_slow_request_span_breakdown(self, tmp_path):
+        profiler = RequestProfiler(
+            is_admin_token=lambda request, token: False,
+            directory=str(tmp_path),
+            slow_ms=0,
+        )
+        with TestClient(make_app(profiler)) as client:
+            client.post("/get_users")
+
+        (trace,) = profiler.get_slow_requests()
+        assert trace["path"] == "/get_users"
+        spans = [span["name"] for span in trace["spans"]]
+        assert spans == ["parse", "endpoint", "db.get_users", "serialize"]
+
+    def test_fast_requests_are_not_kept(self, tmp_path):
+        profiler = RequestProfiler(
+            is_admin_token=lambda request, token: False,
+            directory=str(tmp_path),
+            slow_ms=1e9,
+        )
+        with TestClient(make_app(profiler)) as client:
+            client.post("/get_users")
+
+        assert profiler.get_slow_requests() == []
+        assert os.listdir(tmp_path) == []
+
+    def test_profile_requires_admin_token(self, tmp_path):
+        profiler = RequestProfiler(
+            is_admin_token=lambda request, token: token == "admin-token",
+            directory=str(tmp_path),
+            retention=2,
+        )
+        with TestClient(make_app(profiler)) as client:
+            client.post("/get_users", headers={"X-Profile": "user-token"})
+            assert os.listdir(tmp_path) == []
+
+            for _ in range(3):
+                client.post("/get_users", headers={"X-Profile": "admin-token"})
+
+        profiles = os.listdir(tmp_path)
+        assert len(profiles) == 2
+        assert all(profile.endswith(".folded") for profile in profiles)
+
+    def test_profile_leaves_out_concurrent_requests(self, tmp_path):
+        profiler = RequestProfiler(
+            is_admin_token=lambda request, token: token == "admin-token",
+            directory=str(tmp_path),
+        )
+        app = make_concurrent_app(profiler)
+
+        async def run():
+            async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+                await asyncio.gather(
+                    client.post("/profiled", headers={"X-Profile": "admin-token"}),
+                    client.post("/other"),
+                )
+
+        asyncio.run(run())
+
+        (profile,) = os.listdir(tmp_path)
+        with open(tmp_path / profile) as f:
+            folded = f.read()
+        assert "spin_profiled" in folded
+        assert "spin_other" not in folded
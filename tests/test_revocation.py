@@ -0,0 +1,129 @@
+import os
+import time
+
+import pytest
+from eth_account import Account
+
+from app.db_wrapper import DbWrapper, sign
+from app.revocation import BloomFilter, RevocationIndex
+from app.storage.memory import MemoryStorage
+from app.storage.mongo import MongoStorage
+
+
+class TestBloomFilter:
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        items = [os.urandom(32) for _ in range(1000)]
+        for item in items:
+            bloom.add(item)
+
+        assert all(item in bloom for item in items)
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for _ in range(1000):
+            bloom.add(os.urandom(32))
+
+        false_positives = sum(os.urandom(32) in bloom for _ in range(10000))
+        assert false_positives < 300
+
+
+class TestRevocation:
+    def test_signing_in_again_revokes_older_tokens(self):
+        db = DbWrapper(db_name="test_db", storage=MemoryStorage())
+        account = Account.create()
+
+        first = db.signature(account.address, sign(account, 0))["token"]
+        assert db.verify(first)["publicAddress"] == account.address
+
+        second = db.signature(account.address, sign(account, 1))["token"]
+        assert db.verify(first) is False
+        assert db.verify(second)["publicAddress"] == account.address
+
+    def test_admin_signing_in_again_revokes_older_tokens(self):
+        db = DbWrapper(db_name="test_db", storage=MemoryStorage())
+        account = Account.create()
+        db.admins = db.admins + [account.address.lower()]
+        db.signature(account.address, sign(account, 0))
+
+        signature = sign(account, 1, admin=True)
+        first = db.admin_signature(account.address, signature)["token"]
+        assert db.admin_verify(first)["publicAddress"] == account.address
+        assert db.admin_signature(account.address, signature) is False
+
+        second = db.admin_signature(account.address, sign(account, 2, admin=True))
+        assert db.admin_verify(first) is False
+        assert db.admin_verify(second["token"])["publicAddress"] == account.address
+
+    def test_revoke_token(self):
+        db = DbWrapper(db_name="test_db", storage=MemoryStorage())
+        account = Account.create()
+        token = db.signature(account.address, sign(account, 0))["token"]
+
+        assert db.revoke_token(token)
+        assert db.verify(token) is False
+
+    def test_rebuilt_from_storage(self):
+        storage = MemoryStorage()
+        db = DbWrapper(db_name="test_db", storage=storage)
+        account, other = Account.create(), Account.create()
+        first = db.signature(account.address, sign(account, 0))["token"]
+        db.signature(account.address, sign(account, 1))
+        revoked = db.signature(other.address, sign(other, 0))["token"]
+        db.revoke_token(revoked)
+
+        restarted = DbWrapper(db_name="test_db", storage=storage)
+        assert restarted.verify(first) is False
+        assert restarted.verify(revoked) is False
+
+    def test_rebuilt_past_users_with_invalid_addresses(self):
+        mongomock = pytest.importorskip("mongomock")
+        storage = MongoStorage(client=mongomock.MongoClient(), db_name="test_db")
+        db = DbWrapper(db_name="test_db", storage=storage)
+        account = Account.create()
+        first = db.signature(account.address, sign(account, 0))["token"]
+        revoked = db.signature(account.address, sign(account, 1))["token"]
+        db.revoke_token(revoked)
+        # Left in users by app.migrations, the old API did not validate addresses
+        storage.collection("users").insert_one({"publicAddress": "0x777888999"})
+
+        restarted = DbWrapper(db_name="test_db", storage=storage)
+        assert restarted.verify(first) is False
+        assert restarted.verify(revoked) is False
+
+    def test_index_tracks_minimum_nonce(self):
+        index = RevocationIndex(capacity=10)
+        index.set_nonce(b"key", 5)
+
+        assert index.is_revoked(b"key", 3, "token")
+        assert not index.is_revoked(b"key", 4, "token")
+        assert not index.is_revoked(b"other", 0, "token")
+
+    def test_full_filter_is_rebuilt_without_expired_tokens(self):
+        now = int(time.time())
+        storage = MemoryStorage()
+        db = DbWrapper(db_name="test_db", storage=storage)
+        db.revocations = RevocationIndex(capacity=10)
+        for _ in range(10):  # Logouts of tokens that have expired since
+            revoked_token_id = os.urandom(32)
+            storage.insert_revoked_token(revoked_token_id, now - 1)
+            db.revocations.revoke(revoked_token_id)
+
+        account = Account.create()
+        token = db.signature(account.address, sign(account, 0))["token"]
+        assert db.revocations.needs_refresh()
+
+        assert db.verify(token)["publicAddress"] == account.address
+        assert db.revocations.revoked.count == 0
+        assert not db.revocations.needs_refresh()
+
+    def test_refresh_keeps_live_and_concurrent_revocations(self):
+        index = RevocationIndex(capacity=10, refresh_interval=0)
+        assert index.needs_refresh()
+
+        def load():
+            index.revoke(b"during")  # Revoked while storage is being read
+            return [b"stored"]
+
+        assert index.refresh(load)
+        assert b"stored" in index.revoked and b"during" in index.revoked
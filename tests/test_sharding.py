@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+from app.storage.memory import MemoryStorage
+from app.storage.sharded import (
+    HashRing,
+    ShardedStorage,
+    create_sharded_storage,
+    parse_shards,
+    rebalance,
+)
+
+
+def insert_users(storage, count: int) -> list:
+    keys = [os.urandom(20) for _ in range(count)]
+    for key in keys:
+        storage.insert_user(key, {"publicAddress": "0x" + key.hex(), "nonce": 0})
+    return keys
+
+
+@pytest.fixture
+def shards():
+    return {name: MemoryStorage(db_name=name) for name in ("a", "b", "c")}
+
+
+class TestSharding:
+    def test_ring_is_stable(self):
+        keys = [os.urandom(20) for _ in range(200)]
+        first, second = HashRing(["a", "b", "c"]), HashRing(["c", "a", "b"])
+
+        assert [first.owner(k) for k in keys] == [second.owner(k) for k in keys]
+
+    def test_users_live_on_one_shard(self, shards):
+        storage = ShardedStorage(shards)
+        keys = insert_users(storage, 300)
+
+        for key in keys:
+            holders = [n for n, shard in shards.items() if shard.user_exists(key)]
+            assert holders == [storage.shard_name(key)]
+        assert all(len(shard.user_index) > 50 for shard in shards.values())
+
+    def test_scans_merge_all_shards(self, shards):
+        storage = ShardedStorage(shards)
+        keys = insert_users(storage, 100)
+        email_ids = [storage.insert_email(f"user{i}@example.com") for i in range(20)]
+        storage.insert_revoked_token(b"token", 2**31)
+
+        assert [
+            bytes.fromhex(user["publicAddress"][2:]) for user in storage.find_users()
+        ] == sorted(keys)
+        assert [email["_id"] for email in storage.find_emails()] == email_ids
+        assert list(storage.find_revoked_tokens(0)) == [b"token"]
+
+    def test_rebalance_after_adding_shard(self, shards):
+        keys = insert_users(ShardedStorage(shards), 600)
+        storage = ShardedStorage({**shards, "d": MemoryStorage(db_name="d")})
+
+        assert rebalance(storage, dry_run=True)["moved"] > 0
+        assert not storage.shards["d"].user_index
+
+        result = rebalance(storage)
+        # Only keys taken over by the new shard move, roughly a quarter of them
+        assert result["to"] == {"d": result["moved"]}
+        assert 75 < result["moved"] < 225
+        for key in keys:
+            user = storage.find_user(key)
+            assert user["publicAddress"] == "0x" + key.hex()
+            assert user["nonce"] == 0
+        assert sum(len(shard.user_index) for shard in shards.values()) + len(
+            storage.shards["d"].user_index
+        ) == len(keys)
+        assert rebalance(storage)["moved"] == 0
+
+    def test_rebalance_finishes_interrupted_move(self, shards):
+        keys = insert_users(ShardedStorage(shards), 100)
+        storage = ShardedStorage({**shards, "d": MemoryStorage(db_name="d")})
+        key = next(k for k in keys if storage.shard_name(k) == "d")
+        storage.shards["d"].insert_user(key, {"publicAddress": "0x" + key.hex()})
+
+        rebalance(storage)
+
+        assert [n for n, s in storage.shards.items() if s.user_exists(key)] == ["d"]
+
+    def test_parse_shards(self):
+        assert parse_shards(" a=memory://\n b=mongodb://h1,h2/#test_db ") == {
+            "a": ("memory://", None),
+            "b": ("mongodb://h1,h2/", "test_db"),
+        }
+        with pytest.raises(ValueError):
+            parse_shards("a=memory:// a=sqlite://")
+        with pytest.raises(ValueError):
+            parse_shards("memory://")
+
+    def test_create_sharded_storage(self):
+        storage = create_sharded_storage("a=memory:// b=memory://#test_db", "test_db")
+
+        assert storage.database_names() == ["test_db", "test_db_a"]
+
+    def test_unsharded_store_becomes_a_shard(self):
+        existing = MemoryStorage(db_name="test_db")  # The database before sharding
+        keys = insert_users(existing, 300)
+        storage = ShardedStorage({"old": existing, "new": MemoryStorage()})
+        assert not all(storage.user_exists(key) for key in keys)
+
+        result = rebalance(storage)
+
+        assert result["to"] == {"new": result["moved"]}
+        assert all(storage.find_user(key)["nonce"] == 0 for key in keys)
@@ -0,0 +1,140 @@
+import time
+
+import pytest
+
+from app.models.main import address_key
+from app.storage.base import DuplicateUserError, create_storage
+from app.storage.memory import MemoryStorage
+from app.storage.mongo import MongoStorage
+from app.storage.sharded import ShardedStorage
+from app.storage.sqlite import SqliteStorage
+
+ALICE = "0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAed"
+BOB = "0xfB6916095ca1df60bB79Ce92cE3Ea74c37c5d359"
+
+
+@pytest.fixture(params=["memory", "sqlite", "mongo", "sharded"])
+def storage(request, tmp_path):
+    if request.param == "memory":
+        backend = MemoryStorage()
+    elif request.param == "sqlite":
+        backend = SqliteStorage(path=str(tmp_path / "users.db"))
+    elif request.param == "sharded":
+        backend = ShardedStorage({name: MemoryStorage() for name in "abc"})
+    else:
+        mongomock = pytest.importorskip("mongomock")
+        backend = MongoStorage(client=mongomock.MongoClient(), db_name="test_db")
+
+    backend.ensure_indexes()
+    yield backend
+    backend.close()
+
+
+class TestStorageConformance:
+    def test_insert_and_find_user(self, storage):
+        user_id = storage.insert_user(
+            address_key(ALICE), {"publicAddress": ALICE, "nonce": 0}
+        )
+
+        user = storage.find_user(address_key(ALICE))
+        assert user["_id"] == user_id
+        assert user["publicAddress"] == ALICE
+        assert user["nonce"] == 0
+        assert "addressKey" not in user
+
+    def test_lookup_ignores_address_casing(self, storage):
+        storage.insert_user(address_key(ALICE), {"publicAddress": ALICE, "nonce": 0})
+
+        assert storage.user_exists(address_key(ALICE.lower()))
+        assert storage.find_user(address_key(ALICE.lower()))["publicAddress"] == ALICE
+
+    def test_missing_user(self, storage):
+        assert storage.find_user(address_key(BOB)) is None
+        assert not storage.user_exists(address_key(BOB))
+        assert not storage.update_user(address_key(BOB), {"nonce": 1})
+        assert not storage.delete_user(address_key(BOB))
+
+    def test_duplicate_user_rejected(self, storage):
+        storage.insert_user(address_key(ALICE), {"publicAddress": ALICE, "nonce": 0})
+
+        with pytest.raises(DuplicateUserError):
+            storage.insert_user(address_key(ALICE), {"publicAddress": ALICE})
+
+    def test_update_user_merges_fields(self, storage):
+        storage.insert_user(
+            address_key(ALICE), {"publicAddress": ALICE, "nonce": 0, "name": "Alice"}
+        )
+
+        assert storage.update_user(address_key(ALICE), {"nonce": 1, "bio": "hi"})
+
+        user = storage.find_user(address_key(ALICE))
+        assert (user["nonce"], user["name"], user["bio"]) == (1, "Alice", "hi")
+
+    def test_versions(self, storage):
+        storage.insert_user(address_key(ALICE), {"publicAddress": ALICE, "nonce": 0})
+        assert storage.find_user(address_key(ALICE))["version"] == 1
+
+        assert storage.update_user(address_key(ALICE), {"nonce": 1}) == 2
+        assert storage.update_user(address_key(ALICE), {"nonce": 2}, 1) is None
+        assert storage.update_user(address_key(ALICE), {"nonce": 2}, 2) == 3
+        assert storage.find_user(address_key(ALICE))["nonce"] == 2
+
+    def test_find_user_revision(self, storage):
+        assert storage.find_user_revision(address_key(ALICE)) is None
+
+        user_id = storage.insert_user(address_key(ALICE), {"publicAddress": ALICE})
+        assert storage.find_user_revision(address_key(ALICE)) == (user_id, 1)
+
+        storage.update_user(address_key(ALICE), {"nonce": 1})
+        assert storage.find_user_revision(address_key(ALICE.lower())) == (user_id, 2)
+
+    def test_delete_user(self, storage):
+        storage.insert_user(address_key(ALICE), {"publicAddress": ALICE, "nonce": 0})
+
+        assert storage.delete_user(address_key(ALICE))
+        assert not storage.user_exists(address_key(ALICE))
+
+    def test_find_users(self, storage):
+        for address in (ALICE, BOB):
+            storage.insert_user(address_key(address), {"publicAddress": address})
+
+        addresses = {user["publicAddress"] for user in storage.find_users()}
+        assert addresses == {ALICE, BOB}
+
+    def test_find_users_ordered_by_key(self, storage):
+        keys = [bytes([i]) * 20 for i in (7, 3, 250, 128, 0)]
+        for key in keys:
+            storage.insert_user(key, {"publicAddress": "0x" + key.hex()})
+
+        found = [address_key(user["publicAddress"]) for user in storage.find_users()]
+        assert found == sorted(keys)
+
+    def test_emails(self, storage):
+        storage.insert_email("alice@example.com")
+        storage.insert_email("bob@example.com")
+
+        emails = {email["email"] for email in storage.find_emails()}
+        assert emails == {"alice@example.com", "bob@example.com"}
+
+    def test_revoked_tokens(self, storage):
+        now = int(time.time())
+        storage.insert_revoked_token(b"live", now + 3600)
+        storage.insert_revoked_token(b"expired", now - 3600)
+
+        assert list(storage.find_revoked_tokens(now)) == [b"live"]
+
+
+class TestCreateStorage:
+    def test_backends(self):
+        assert isinstance(create_storage("memory://", "test_db"), MemoryStorage)
+        assert isinstance(create_storage("sqlite://", "test_db"), SqliteStorage)
+
+    def test_missing_url_defaults_to_local_mongo(self):
+        for url in (None, ""):
+            storage = create_storage(url, "test_db")
+            try:
+                assert isinstance(storage, MongoStorage)
+                servers = storage.client.topology_description.server_descriptions()
+                assert set(servers) == {("localhost", 27017)}
+            finally:
+                storage.close()